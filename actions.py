@@ -1,8 +1,12 @@
 import curses
 import curses.ascii
-import subprocess
 
+import buffer
+import cells
 import debug
+import layout
+import point
+import stats
 
 clipboard = None
 
@@ -16,10 +20,10 @@ def command_insert_char(widget, key):
         debug.log(raw)
 
         if widget.multiline:
-            r = subprocess.run(["sh", "-n"], input=raw, capture_output=True)
-            debug.log(r)
-            if r.stderr:
+            start = stats.now()
+            if not widget.syntax.complete(widget.text):
                 raw = None
+            stats.since("check", start)
         if raw:
             widget.complete = raw
             widget.clear()
@@ -40,18 +44,25 @@ def prompt_insert_char(widget, key):
 def copy_selection(widget, key):
     global clipboard
 
-    if not all((widget.p0.valid, widget.p1.valid)):
+    if not (widget.p0.valid() and widget.p1.valid()):
         return
 
     clipboard = widget.text.select(widget.p0, widget.p1)
 
 
 def cut_selection(widget, key):
-    if not all((widget.p0.valid, widget.p1.valid)):
+    if not (widget.p0.valid() and widget.p1.valid()):
         return
 
     copy_selection(widget, key)
 
+    removed = clipboard
+    last = len(widget.text) - 1
+    if widget.p1.y == last and widget.p1.x > len(widget.text[last]):
+        # There is no newline after the last line to remove.
+        removed = removed[:-1]
+
+    widget.history.record(widget.p0.x, widget.p0.y, removed, b"")
     widget.text.remove(widget.p0, widget.p1)
 
     widget.clear_selection()
@@ -80,14 +91,24 @@ def cursor_left(widget, key):
     widget.cursor.x -= 1
     widget.screen.x -= 1
 
+    cursor_skip_combining(widget, -1)
+
 
 def cursor_next_page(widget, key):
+    if widget.wrap:
+        cursor_rows(widget, widget.height)
+        return
+
     widget.cursor.y = min(len(widget.text) - 1, widget.cursor.y + widget.height)
     if widget.cursor.y == len(widget.text) - 1:
         widget.screen.y = widget.height - 1
 
 
 def cursor_prev_page(widget, key):
+    if widget.wrap:
+        cursor_rows(widget, -widget.height)
+        return
+
     widget.cursor.y = max(0, widget.cursor.y - widget.height)
     if not widget.cursor.y:
         widget.screen.y = 0
@@ -97,6 +118,28 @@ def cursor_right(widget, key):
     widget.cursor.x += 1
     widget.screen.x += 1
 
+    cursor_skip_combining(widget, 1)
+
+
+def cursor_rows(widget, n):
+    # Move the cursor n rows, keeping its column, when wrapping.
+    line = widget.text[widget.cursor.y]
+    r, c = layout.place(line, widget.cursor.x, widget.width)
+
+    y, r, moved = layout.walk(widget.text, widget.cursor.y, r, n, widget.width)
+
+    widget.cursor.set(layout.index(widget.text[y], r, c, widget.width), y)
+    if abs(n) > moved:
+        # At the start or end. Show as much as possible.
+        widget.screen.y = widget.height - 1 if n > 0 else 0
+
+
+def cursor_skip_combining(widget, by):
+    # Don't leave the cursor between a character and the ones combined with it.
+    line = widget.text[widget.cursor.y]
+    while 0 < widget.cursor.x < len(line) and not cells.char(line[widget.cursor.x]):
+        widget.cursor.x += by
+
 
 def cursor_start_of_buffer(widget, key):
     widget.cursor.x = 0
@@ -110,6 +153,15 @@ def cursor_start_of_line(widget, key):
     widget.screen.x = 0
 
 
+def cursor_to(widget, p):
+    # Move the cursor to p, after an edit is undone or redone. The selection
+    # may no longer be in the text.
+    widget.screen.move(p.x - widget.cursor.x, p.y - widget.cursor.y)
+    widget.cursor.set(p.x, p.y)
+
+    widget.clear_selection()
+
+
 def cursor_up(widget, key):
     widget.cursor.y -= 1
     widget.screen.y -= 1
@@ -122,16 +174,17 @@ def delete_char(widget, key):
         if prev >= 0:
             # There are previous lines.
             widget.cursor.x = len(widget.text[prev])
-            widget.text[prev] += widget.text[widget.cursor.y]
-            widget.text = (
-                widget.text[: widget.cursor.y] + widget.text[widget.cursor.y + 1 :]
-            )
+            widget.history.record(widget.cursor.x, prev, b"\n", b"")
+            end = point.Point(widget.cursor.x + 1, prev)
+            widget.text.remove(point.Point(widget.cursor.x, prev), end)
             widget.cursor.y = prev
             widget.screen.x = widget.cursor.x
             widget.screen.y -= 1
         return
 
     line = widget.text[widget.cursor.y]
+    removed = line[widget.cursor.x - 1].encode("utf8")
+    widget.history.record(widget.cursor.x - 1, widget.cursor.y, removed, b"")
     widget.text[widget.cursor.y] = line[: widget.cursor.x - 1] + line[widget.cursor.x :]
     widget.cursor.x -= 1
     widget.screen.x -= 1
@@ -139,12 +192,8 @@ def delete_char(widget, key):
 
 def insert_char(widget, key):
     if key == "^J":
-        widget.text = (
-            widget.text[: widget.cursor.y]
-            + [widget.text[widget.cursor.y][: widget.cursor.x]]
-            + [widget.text[widget.cursor.y][widget.cursor.x :]]
-            + widget.text[widget.cursor.y + 1 :]
-        )
+        widget.history.record(widget.cursor.x, widget.cursor.y, b"", b"\n")
+        widget.text.insert(widget.cursor, b"\n")
         widget.cursor.x = 0
         widget.cursor.y += 1
         widget.screen.x = 0
@@ -153,6 +202,8 @@ def insert_char(widget, key):
 
     if len(key) == 1 and curses.ascii.isprint(ord(key)):
         line = widget.text[widget.cursor.y]
+        inserted = key.encode("utf8")
+        widget.history.record(widget.cursor.x, widget.cursor.y, b"", inserted)
         widget.text[widget.cursor.y] = (
             line[: widget.cursor.x] + key + line[widget.cursor.x :]
         )
@@ -161,10 +212,9 @@ def insert_char(widget, key):
 
 
 def mouse_left_pressed(widget, x, y):
-    widget.s.y = min(y + widget.cursor.y - widget.screen.y, len(widget.text) - 1)
-    widget.s.x = min(
-        x + widget.cursor.x - widget.screen.x, len(widget.text[widget.s.y]) + 1
-    )
+    r, s = widget.position(x, y)
+    widget.s.y = min(s, len(widget.text) - 1)
+    widget.s.x = min(r, len(widget.text[widget.s.y]) + 1)
 
     widget.button.x = x
     widget.button.y = y
@@ -177,8 +227,7 @@ def mouse_left_pressed(widget, x, y):
 
 def mouse_left_released(widget, x, y):
     if widget.button.equal(x, y):
-        widget.cursor.x += x - widget.screen.x
-        widget.cursor.y += y - widget.screen.y
+        widget.cursor.set(*widget.position(x, y))
         widget.screen.x = x
         widget.screen.y = y
 
@@ -200,8 +249,9 @@ def mouse_move(widget, x, y):
     if widget.s.x == -1 or widget.s.y == -1:
         return
 
-    s = min(y + widget.cursor.y - widget.screen.y, len(widget.text) - 1)
-    r = min(x + widget.cursor.x - widget.screen.x, len(widget.text[s]) + 1)
+    r, s = widget.position(x, y)
+    s = min(s, len(widget.text) - 1)
+    r = min(r, len(widget.text[s]) + 1)
 
     if s < widget.s.y or s == widget.s.y and r < widget.s.x:
         widget.p0.x = r
@@ -214,22 +264,35 @@ def mouse_move(widget, x, y):
         widget.p1.x = r
         widget.p1.y = s
 
-    debug.log(
-        f"selected from {widget.p0.x},{widget.p0.y} to {widget.p1.x},{widget.p1.y}"
-    )
+    debug.log("selected from", widget.p0.get(), "to", widget.p1.get())
 
 
 def paste_selection(widget, key):
     if not clipboard:
         return
 
-    debug.log(f"PASTING: {repr(clipboard)}")
+    debug.log("pasting:", clipboard)
 
+    widget.history.record(widget.cursor.x, widget.cursor.y, b"", clipboard)
     widget.text.insert(widget.cursor, clipboard)
 
 
+def redo_edit(widget, key):
+    moved = widget.history.redo(widget.text)
+    if moved:
+        cursor_to(widget, moved)
+
+
 def save_file(widget, key):
+    if widget.loader or widget.saver:
+        # Don't save a file that hasn't finished loading, or is being saved.
+        return
+
     if widget.filename:
-        with open(widget.filename, "w") as file:
-            file.write("\n".join(widget.text))
-            file.write("\n")
+        widget.saver = buffer.Saver(widget.text, widget.filename)
+
+
+def undo_edit(widget, key):
+    moved = widget.history.undo(widget.text)
+    if moved:
+        cursor_to(widget, moved)
@@ -0,0 +1,329 @@
+"""Bench - replay output traces through the console without a terminal.
+
+Usage:
+  bench.py [-j] [-b BYTES] [-f MS] [-k MS] [-r ROWS] [-c COLS] [TRACE...]
+  bench.py --one [-f MS] [-k MS] [-r ROWS] [-c COLS] TRACE
+
+Options:
+  -h --help         Show this help output.
+  -j --json         Report results as JSON.
+  -b --bytes=BYTES  Size of each generated trace. [default: 8388608]
+  -f --frame=MS     Minimum milliseconds between renders of output.
+                    [default: 16]
+  -k --keys=MS      Milliseconds between keystrokes. [default: 10]
+  -r --rows=ROWS    Screen rows. [default: 40]
+  -c --cols=COLS    Screen columns. [default: 120]
+  --one             Replay a single trace file and report JSON (internal).
+
+A trace is either the name of a generated trace (build, ls, progress or
+json), or a file holding a program's output (e.g. saved with cmd > trace).
+The default is all of the generated traces.
+
+Each trace is replayed in its own process by a child, running cat, on a
+pseudo-terminal. The console's main loop runs as it normally would but draws
+on a screen that only counts what is drawn. Keystrokes are typed on another
+pseudo-terminal while output is being replayed.
+"""
+
+import curses
+import fcntl
+import json
+import os
+import random
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tty
+
+import docopt
+
+# Generated traces.
+
+
+def build(n):
+    """A parallel build log with the occasional colored warning."""
+    r = random.Random(1)
+    out = []
+    size = 0
+    while size < n:
+        m = f"module_{r.randrange(5000)}"
+        line = f"gcc -c -O2 -Wall -Isrc/include src/{m}.c -o build/{m}.o\n"
+        if r.random() < 0.05:
+            line += (
+                f"src/{m}.c:{r.randrange(1000)}:5: \x1b[1;35mwarning:\x1b[0m "
+                f"unused variable 'tmp' [-Wunused-variable]\n"
+            )
+        out.append(line)
+        size += len(line)
+    return "".join(out).encode("utf8")
+
+
+def listing(n):
+    """Recursive directory listings."""
+    r = random.Random(2)
+    out = []
+    size = 0
+    while size < n:
+        path = "/".join(f"dir{r.randrange(50)}" for _ in range(r.randrange(1, 6)))
+        names = "  ".join(
+            f"file{r.randrange(10000)}.txt" for _ in range(r.randrange(20))
+        )
+        block = f"./{path}:\n{names}\n\n"
+        out.append(block)
+        size += len(block)
+    return "".join(out).encode("utf8")
+
+
+def progress(n):
+    """Progress bars redrawn with carriage returns."""
+    out = []
+    size = 0
+    task = 0
+    while size < n:
+        for pct in range(101):
+            bar = "#" * (pct // 2) + " " * (50 - pct // 2)
+            s = f"\rtask {task}: {pct:3}% [{bar}] {pct * 1.7:.1f} MB/s"
+            out.append(s)
+            size += len(s)
+        out.append("\n")
+        task += 1
+    return "".join(out).encode("utf8")
+
+
+def records(n):
+    """JSON documents, each on one very long line."""
+    r = random.Random(3)
+    out = []
+    size = 0
+    while size < n:
+        doc = [
+            {"id": r.randrange(1 << 30), "name": f"item {i}", "tags": ["a", "b"]}
+            for i in range(5000)
+        ]
+        line = json.dumps(doc) + "\n"
+        out.append(line)
+        size += len(line)
+    return "".join(out).encode("utf8")
+
+
+GENERATED = {"build": build, "ls": listing, "progress": progress, "json": records}
+
+
+class Screen:
+    """A stand-in for a curses window that records when it is refreshed."""
+
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+
+        self.cells = 0
+        self.delay = False
+        self.refreshes = 0
+
+        # When each key was typed, when each key read was typed, and the
+        # time from typing each key to the refresh that followed it.
+        self.typed = []
+        self.read = []
+        self.latencies = []
+
+    def addstr(self, y, x, s, attr=0):
+        self.cells += len(s)
+
+    def clear(self):
+        pass
+
+    def getch(self):
+        try:
+            c = os.read(0, 1)
+        except BlockingIOError:
+            return -1
+
+        self.read.append(self.typed.pop(0))
+        return curses.KEY_BACKSPACE if c == b"\x7f" else c[0]
+
+    def getmaxyx(self):
+        return self.rows, self.cols
+
+    def keypad(self, flag):
+        pass
+
+    def move(self, y, x):
+        pass
+
+    def nodelay(self, flag):
+        self.delay = flag
+
+    def refresh(self):
+        now = time.monotonic()
+
+        self.refreshes += 1
+        self.latencies.extend(now - t for t in self.read)
+        self.read.clear()
+
+
+def generate(name, n, directory):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(GENERATED[name](n))
+    return path
+
+
+def peak():
+    """Return the peak resident set size of this process in KiB."""
+    # Linux keeps ru_maxrss across exec, so it would include the parent's
+    # peak, while VmHWM starts again.
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def one(path, frame, keys, rows, cols):
+    """Replay the trace in path and return the measurements."""
+    # The user's terminal is a pseudo-terminal with nothing on the other end
+    # but the thread typing keys.
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    fcntl.ioctl(slave, tty.TIOCSWINSZ, struct.pack("HHHH", rows, cols, 0, 0))
+    os.dup2(slave, 0)
+
+    # Anything written to the terminal is discarded.
+    null = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(null, 1)
+
+    os.environ.setdefault("TERM", "xterm")
+    sys.argv = ["console.py", "-f", str(frame)]
+
+    import console
+    import session
+
+    console.load()
+    terminal = console.terminal
+
+    # Initialize curses, for key names, without drawing on its screen.
+    curses.initscr()
+    terminal.previous_rows, terminal.previous_cols = rows, cols
+
+    console.pfds = console.pipe()
+    pid, fd = session.spawn(["cat", path])
+
+    term = terminal.Terminal()
+    screen = term.stdscr = Screen(rows, cols)
+    console.sessions.add(session.Session(pid, fd, term))
+
+    done = False
+
+    def typist():
+        # Type, and then delete, one character at a time.
+        n = 0
+        while not done:
+            screen.typed.append(time.monotonic())
+            os.write(master, b"\x7f" if n % 2 else b"a")
+            n += 1
+            time.sleep(keys / 1000)
+
+    thread = threading.Thread(target=typist, daemon=True)
+
+    start = time.monotonic()
+    thread.start()
+    console.main(term)
+    elapsed = time.monotonic() - start
+
+    done = True
+
+    os.waitpid(pid, 0)
+
+    latencies = sorted(screen.latencies)
+
+    def percentile(p):
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    size = os.path.getsize(path)
+
+    return {
+        "bytes": size,
+        "seconds": elapsed,
+        "bytes/s": size / elapsed,
+        "renders": screen.refreshes,
+        "renders/s": screen.refreshes / elapsed,
+        "cells": screen.cells,
+        "keys": len(latencies),
+        "p50 ms": percentile(0.5),
+        "p99 ms": percentile(0.99),
+        "peak rss KiB": peak(),
+    }
+
+
+def report(results):
+    print(
+        f"{'trace':<12} {'MiB':>7} {'MiB/s':>8} {'renders/s':>10}"
+        f" {'p50 ms':>7} {'p99 ms':>7} {'rss MiB':>8}"
+    )
+
+    for name, r in results.items():
+        p50 = "-" if r["p50 ms"] is None else f"{r['p50 ms']:.1f}"
+        p99 = "-" if r["p99 ms"] is None else f"{r['p99 ms']:.1f}"
+        print(
+            f"{name:<12} {r['bytes'] / (1 << 20):>7.1f}"
+            f" {r['bytes/s'] / (1 << 20):>8.2f} {r['renders/s']:>10.1f}"
+            f" {p50:>7} {p99:>7} {r['peak rss KiB'] / 1024:>8.1f}"
+        )
+
+
+def run(parsed):
+    traces = parsed["TRACE"] or list(GENERATED)
+
+    shared = []
+    for flag in ("--frame", "--keys", "--rows", "--cols"):
+        shared.extend((flag, parsed[flag]))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for trace in traces:
+            path = trace
+            if trace in GENERATED:
+                path = generate(trace, int(parsed["--bytes"]), directory)
+
+            # Each trace gets a fresh process so that peak RSS is its own.
+            out = subprocess.run(
+                [sys.executable, __file__, "--one", *shared, path],
+                check=True,
+                stdout=subprocess.PIPE,
+            )
+            results[trace] = json.loads(out.stdout)
+
+    if parsed["--json"]:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+
+
+if __name__ == "__main__":
+    parsed = docopt.docopt(__doc__)
+
+    if parsed["--one"]:
+        # The results go to the original standard output.
+        out = os.fdopen(os.dup(1), "w")
+
+        result = one(
+            parsed["TRACE"][0],
+            int(parsed["--frame"]),
+            int(parsed["--keys"]),
+            int(parsed["--rows"]),
+            int(parsed["--cols"]),
+        )
+
+        print(json.dumps(result), file=out, flush=True)
+    else:
+        run(parsed)
@@ -33,9 +33,10 @@ default_bindings = {
 }
 
 cli_bindings = default_bindings.copy()
+cli_bindings.update({"^Y": redo_edit, "^Z": undo_edit})
 
 editor_bindings = default_bindings.copy()
-editor_bindings.update({"^S": save_file})
+editor_bindings.update({"^S": save_file, "^Y": redo_edit, "^Z": undo_edit})
 
 prompt_bindings = default_bindings.copy()
 
@@ -1,119 +1,361 @@
+import bisect
+import codecs
 import collections
+import itertools
+import mmap
+import os
 import re
+import threading
 
+import cells
 import debug
 import point
+import sgr
 
 
-class Buffer(collections.UserList):
+# The most lines held in a block.
+BLOCK = 512
+
+# The least bytes held in a block loaded from a file.
+CHUNK = 1 << 15
+
+# The most blocks loaded from a file kept decoded. Others are decoded again
+# from the mapped file when used.
+DECODED = 128
+
+# Long ASCII lines are cut after a multiple of this many characters before
+# they are shown.
+CUT = 1 << 12
+
+
+class Buffer:
+    """A list of lines stored as a list of blocks of lines.
+
+    Lines are found by bisecting the line number at the start of each block
+    and edits only copy the blocks they touch. Changing a line near the top of
+    a large buffer doesn't copy the whole buffer."""
+
     def __init__(self, data):
-        super().__init__(data)
+        lines = list(data)
+
+        self.blocks = [lines[i : i + BLOCK] for i in range(0, len(lines), BLOCK)]
+        if not self.blocks:
+            self.blocks = [[]]
+
+        # Values derived from each block, like its text for searching, are
+        # cached until the block changes.
+        self.caches = [None] * len(self.blocks)
+
+        # The runs of each line in each block, or None for a block of plain
+        # lines. See sgr.py.
+        self.renditions = [None] * len(self.blocks)
+
+        # The line number at the start of each block. Line numbers are
+        # offset by base, the number of lines evicted, so that evicting a
+        # block doesn't renumber the blocks after it.
+        self.base = 0
+        self.starts = []
+        self.length = 0
+
+        self.reindex(0)
+
+        # The approximate size of the text in bytes.
+        self.size = sum(map(measure, self.blocks))
+
+        # Incremented on every change so that panels can skip redrawing.
+        self.version = 0
+
+        # What lines are saved ending with, as in the file loaded, if any.
+        self.newline = "\n"
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, _ = i.indices(self.length)
+            return self.lines(start, stop)
+
+        b, i = self.locate(i)
+        return self.blocks[b][i]
+
+    def __iter__(self):
+        for block in self.blocks:
+            yield from block
+
+    def __len__(self):
+        return self.length
+
+    def __setitem__(self, i, line):
+        runs = self.style(i)
+        if runs:
+            # The characters that changed are plain. The runs of the others
+            # move with them.
+            old = self[i]
+            p = common(old, line)
+            s = common(old[p:][::-1], line[p:][::-1])
+            after = sgr.cut(runs, len(old) - s)
+            runs = sgr.join(sgr.join(runs, p, None), len(line) - s, after)
+
+        self.assign(i, line, runs)
 
     def append(self, raw):
         self.insert(self.end(), raw)
 
+    def assign(self, i, line, runs):
+        """Set line i and its runs."""
+        b, j = self.locate(i)
+
+        block = self.blocks[b]
+        if isinstance(block, Lazy):
+            # Edits are kept in memory. The mapped file is never changed.
+            self.size -= block.size
+            block = self.blocks[b] = list(block.lines())
+            self.size += measure(block)
+
+        self.size += len(line) - len(block[j])
+        block[j] = line
+        self.caches[b] = None
+        self.version += 1
+
+        self.restyle(i, runs)
+
     def end(self):
         return point.Point(len(self[-1]), len(self) - 1)
 
+    def cached(self, b, key, derive):
+        """Return derive(block) for block b, cached under key."""
+        block = self.blocks[b]
+        if isinstance(block, Lazy):
+            # Kept only while the block is decoded.
+            cache = block.cache()
+        else:
+            cache = self.caches[b]
+            if cache is None:
+                cache = self.caches[b] = {}
+
+        if key not in cache:
+            cache[key] = derive(block)
+
+        return cache[key]
+
     def chunks(self, width, row, col, p0, p1):
-        blank = " " * width
+        """Yield the chunks of row shown in width columns from column col."""
+        line = self[row] if 0 <= row < len(self) else ""
+
+        # The selected characters are from a up to b.
+        a = b = 0
+        if p0.y <= row <= p1.y:
+            a = p0.x if row == p0.y else 0
+            b = p1.x if row == p1.y else len(line) + 1
+
+        if b > len(line):
+            # The "newline" is also selected.
+            b = len(line) + 1
+            line += " "
+
+        end = col + width
         shift = 0
 
-        if 0 <= row < len(self):
-            line = self[row]
+        if line.isascii() and not cells.simple(line):
+            # ASCII characters are at least one column wide so none past end
+            # are shown, however long the line. The line is cut at a multiple
+            # of CUT, rather than at end, so that what is left is the same
+            # from one render to the next while scrolling along it, and its
+            # columns stay cached.
+            line = line[: end - end % CUT + CUT]
+
+        # Chunks start where the selection or the attribute changes.
+        runs = self.style(row) if 0 <= row < len(self) else None
+
+        edges = {0, a, b, len(line)}
+        if runs:
+            edges.update(runs[::2])
+        edges = sorted(x for x in edges if x <= len(line))
+
+        for start, stop in zip(edges, edges[1:]):
+            lo = max(col, cells.column(line, start))
+            hi = min(end, cells.column(line, stop))
+            if lo < hi:
+                sel = a <= start < b
+                attr = sgr.at(runs, start)
+                yield Chunk(lo - col, sel, attr, cells.clip(line, lo, hi))
+
+                shift = hi - col
+
+        if shift < width:
+            yield Chunk(shift, False, 0, " " * (width - shift))
+
+    def evict(self, lines, size):
+        """Evict the oldest blocks of lines while more than lines lines, or
+        size bytes, would remain. A limit of zero means no limit. Returns the
+        number of lines evicted."""
+        n = 0
+        while len(self.blocks) > 1:
+            first = self.blocks[0]
+            if not (
+                lines and self.length - len(first) >= lines
+                or size and self.size - measure(first) >= size
+            ):
+                break
+
+            del self.blocks[0]
+            del self.caches[0]
+            del self.renditions[0]
+            del self.starts[0]
+
+            self.base += len(first)
+            self.length -= len(first)
+            self.size -= measure(first)
+
+            n += len(first)
+
+        if n:
+            self.version += 1
+
+        return n
+
+    def extend(self, pieces):
+        """Append pieces of decoded lines, each with the attribute it is shown
+        with. The first line of each piece continues the last line."""
+        lines = [self[-1]]
+        runs = [self.style(-1)]
+
+        for more, attr in pieces:
+            if more[0]:
+                runs[-1] = sgr.extend(runs[-1], len(lines[-1]), attr)
+
+                lines[-1] += more[0]
+                if "\t" in more[0]:
+                    lines[-1] = lines[-1].expandtabs()
+
+            lines.extend(more[1:])
+            runs.extend([sgr.extend(None, 0, attr)] * (len(more) - 1))
 
-            if row < p0.y or p1.y < row:
-                # The line is not within the selected region.
-                unselected = line[col:][:width]
-                yield Chunk(0, False, unselected)
+        if len(lines) == 1:
+            self.assign(-1, lines[0], runs[0])
+            return
 
-                shift += len(unselected)
-                width -= len(unselected)
+        self.splice(len(self) - 1, len(self), lines, runs)
 
-            if p0.y < row < p1.y:
-                # The line is completely within the selected region.
-                selected = (line[col:] + blank[:1])[:width]
-                yield Chunk(0, True, selected)
+    def insert(self, cursor, raw):
+        lines = split(raw)
 
-                shift += len(selected)
-                width -= len(selected)
+        line = self[cursor.y]
+        if len(lines) == 1:
+            self[cursor.y] = line[: cursor.x] + lines[0] + line[cursor.x :]
+            return
 
-            if row == p0.y:
-                # The line is at the start of the selected region.
-                if col < p0.x:
-                    unselected = line[col : p0.x][:width]
-                    yield Chunk(0, False, unselected)
+        # What is inserted is plain. The rest of the line keeps its runs.
+        runs = [None] * len(lines)
+        style = self.style(cursor.y)
+        if style:
+            runs[0] = sgr.join(style, cursor.x, None)
+            runs[-1] = sgr.join(None, len(lines[-1]), sgr.cut(style, cursor.x))
 
-                    shift += len(unselected)
-                    width -= len(unselected)
+        lines[0] = line[: cursor.x] + lines[0]
+        lines[-1] = lines[-1] + line[cursor.x :]
 
-                if width > 0 and row < p1.y:
-                    selected = (line[col + shift :] + blank[:1])[:width]
-                    yield Chunk(shift, True, selected)
+        self.splice(cursor.y, cursor.y + 1, lines, runs)
 
-                    shift += len(selected)
-                    width -= len(selected)
+    def lines(self, start, stop):
+        if start >= stop:
+            return []
 
-            if row == p1.y:
-                # The line is at the end of the selected region.
-                if width > 0 and col + shift < p1.x:
-                    selected = line[col + shift : p1.x][:width]
-                    yield Chunk(shift, True, selected)
+        b, i = self.locate(start)
 
-                    shift += len(selected)
-                    width -= len(selected)
+        lines = []
+        n = stop - start
+        while len(lines) < n:
+            lines.extend(self.blocks[b][i : i + n - len(lines)])
+            b += 1
+            i = 0
 
-                if width > 0:
-                    if len(line) < p1.x:
-                        # The "newline" is also selected.
-                        yield Chunk(shift, True, blank[:1])
+        return lines
 
-                        shift += 1
-                        width -= 1
+    def load(self, blocks):
+        """Append blocks of lines loaded from a file."""
+        if not blocks:
+            return
 
-                    else:
-                        unselected = line[p1.x :][:width]
-                        yield Chunk(shift, False, unselected)
+        b = len(self.blocks)
+        if not self.length:
+            b = 0
 
-                        shift += len(unselected)
-                        width -= len(unselected)
+        self.size += sum(map(measure, blocks))
 
-        if width:
-            yield Chunk(shift, False, blank[:width])
+        self.blocks[b:] = blocks
+        self.caches[b:] = [None] * len(blocks)
+        self.renditions[b:] = [None] * len(blocks)
 
-    def insert(self, cursor, raw):
-        lines = split(raw)
-        if len(lines) == 1:
-            self[cursor.y] = (
-                self[cursor.y][: cursor.x] + lines[0] + self[cursor.y][cursor.x :]
-            )
-            return
+        self.reindex(b)
+        self.version += 1
+
+    def locate(self, i):
+        """Return the block holding line i and the line's index in that block."""
+        if i < 0:
+            i += self.length
+
+        if not 0 <= i < self.length:
+            raise IndexError("buffer index out of range")
+
+        i += self.base
+
+        b = bisect.bisect_right(self.starts, i) - 1
+
+        return b, i - self.starts[b]
 
-        self.data = (
-            self[: cursor.y]
-            + [self[cursor.y][: cursor.x] + lines[0]]
-            + lines[1:-1]
-            + [lines[-1] + self[cursor.y][cursor.x :]]
-            + self[cursor.y + 1 :]
-        )
+    def position(self, i):
+        # Like locate but also accepts the position after the last line.
+        if i >= self.length:
+            return len(self.blocks) - 1, len(self.blocks[-1])
+
+        return self.locate(i)
 
     def raw(self):
         return join(self)
 
+    def reindex(self, b):
+        """Recalculate the start of every block from block b onward."""
+        n = self.base
+        if b:
+            n = self.starts[b - 1] + len(self.blocks[b - 1])
+
+        starts = list(itertools.accumulate(map(len, self.blocks[b:]), initial=n))
+
+        self.length = starts.pop() - self.base
+        self.starts[b:] = starts
+
     def remove(self, p0, p1):
-        remainder = self[p1.y + 1 :]
+        stop = p1.y + 1
 
+        below = self[p1.y][p1.x :]
+        runs = sgr.cut(self.style(p1.y), p1.x)
         if p1.x > len(self[p1.y]):
+            # The "newline" is also selected. Join the line below.
             below = ""
-            if len(remainder):
-                below = remainder[:1][0]
-                remainder = remainder[1:]
+            runs = None
+            if stop < len(self):
+                below = self[stop]
+                runs = self.style(stop)
+                stop += 1
 
-            self[p0.y] = self[p0.y][: p0.x] + below
-        else:
-            self[p0.y] = self[p0.y][: p0.x] + self[p1.y][p1.x :]
+        runs = sgr.join(self.style(p0.y), p0.x, runs)
+
+        self.splice(p0.y, stop, [self[p0.y][: p0.x] + below], [runs])
+
+    def restyle(self, i, runs):
+        """Set the runs of line i."""
+        b, i = self.locate(i)
+
+        if self.renditions[b] is None:
+            if runs is None:
+                return
+
+            self.renditions[b] = [None] * len(self.blocks[b])
 
-        self.data = self[: p0.y + 1] + remainder
+        self.renditions[b][i] = runs
+
+    def start(self, b):
+        """Return the line number of the first line in block b."""
+        return self.starts[b] - self.base
 
     def select(self, p0, p1):
         if p0.y == p1.y:
@@ -129,16 +371,348 @@ class Buffer(collections.UserList):
 
         return raw
 
+    def splice(self, start, stop, lines, runs=None):
+        """Replace the lines from start up to, but not including, stop. The
+        new lines are plain unless their runs are given."""
+        b0, i0 = self.position(start)
+        b1, i1 = self.position(stop)
+
+        if runs is None:
+            runs = [None] * len(lines)
+
+        lines = self.blocks[b0][:i0] + lines + self.blocks[b1][i1:]
+        runs = self.styles(b0)[:i0] + runs + self.styles(b1)[i1:]
+
+        # Absorb the following block, if small, to avoid fragmentation.
+        if len(lines) < BLOCK // 2 and b1 + 1 < len(self.blocks):
+            b1 += 1
+            lines.extend(self.blocks[b1])
+            runs.extend(self.styles(b1))
+
+        blocks = [lines[i : i + BLOCK] for i in range(0, len(lines), BLOCK)]
+        renditions = [runs[i : i + BLOCK] for i in range(0, len(runs), BLOCK)]
+        if not blocks and len(self.blocks) == b1 - b0 + 1:
+            blocks = [[]]
+            renditions = [[]]
+
+        self.size -= sum(map(measure, self.blocks[b0 : b1 + 1]))
+        self.size += sum(map(measure, blocks))
+
+        self.blocks[b0 : b1 + 1] = blocks
+        self.caches[b0 : b1 + 1] = [None] * len(blocks)
+        self.renditions[b0 : b1 + 1] = [r if any(r) else None for r in renditions]
+
+        self.reindex(b0)
+        self.version += 1
+
+    def style(self, i):
+        """Return the runs of line i, or None if it is plain."""
+        b, i = self.locate(i)
+
+        renditions = self.renditions[b]
+        return renditions[i] if renditions else None
+
+    def styles(self, b):
+        return self.renditions[b] or [None] * len(self.blocks[b])
+
+
+class Decoder:
+    """Incrementally decodes UTF-8 output into lines.
+
+    A code point, or a CR LF pair, split across reads is carried over to the
+    next read so that each byte is decoded exactly once."""
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder("utf8")("replace")
+        self.cr = False
+
+    def decode(self, raw):
+        """Return the lines in raw. The first line continues the last line."""
+        text = self.decoder.decode(raw)
+
+        if self.cr:
+            text = "\r" + text
+            self.cr = False
+
+        if text.endswith("\r"):
+            text = text[:-1]
+            self.cr = True
+
+        text = text.replace("\r\n", "\n")
+
+        lines = text.split("\n")
+        if "\t" in text:
+            # The first line is expanded when it is joined to the last line.
+            lines[1:] = [line.expandtabs() for line in lines[1:]]
+
+        return lines
+
+
+class Lazy:
+    """A block of lines in a memory-mapped file, decoded when used. Only the
+    most recently used blocks are kept decoded, so memory is bounded however
+    much of the file is read."""
+
+    def __init__(self, mapped, start, end, count):
+        self.mapped = mapped
+        self.start = start
+        self.end = end
+
+        self.count = count
+
+        self.size = end - start
+
+    def __getitem__(self, i):
+        return self.lines()[i]
+
+    def __iter__(self):
+        return iter(self.lines())
+
+    def __len__(self):
+        return self.count
+
+    def cache(self):
+        """Return a dict for what is derived from the lines, kept with them."""
+        return self.decoded()[1]
+
+    def decode(self):
+        text = self.mapped[self.start : self.end].decode("utf8", "replace")
+        if text.endswith("\n"):
+            text = text[:-1]
+
+        lines = text.split("\n")
+        if "\r" in text:
+            lines = [line.rstrip("\r") for line in lines]
+
+        return lines
+
+    def decoded(self):
+        entry = recent.get(self)
+        if entry is None:
+            entry = recent[self] = (self.decode(), {})
+            if len(recent) > DECODED:
+                recent.popitem(last=False)
+        else:
+            recent.move_to_end(self)
+
+        return entry
+
+    def lines(self):
+        return self.decoded()[0]
+
+
+class Loader:
+    """Memory-maps a file and finds its blocks of lines in the background.
+
+    The first block is found immediately so that it can be displayed while
+    the rest of the file is indexed."""
+
+    def __init__(self, filename):
+        with open(filename, "rb") as file:
+            self.mapped = None
+            if os.fstat(file.fileno()).st_size:
+                self.mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Blocks are only appended by the indexing thread. The first taken
+        # blocks have not been taken yet.
+        self.found = []
+        self.taken = 0
+
+        # The line ending of the first line, for lines that are edited.
+        self.newline = "\n"
+
+        self.done = self.mapped is None
+        if self.done:
+            return
+
+        end = self.mapped.find(b"\n")
+        if end > 0 and self.mapped[end - 1] == ord("\r"):
+            self.newline = "\r\n"
+
+        start = self.index(0)
+
+        threading.Thread(target=self.run, args=(start,), daemon=True).start()
+
+    def index(self, start):
+        """Find the block starting at start. Returns where the next starts."""
+        mapped = self.mapped
+
+        end = mapped.find(b"\n", start + CHUNK)
+        end = len(mapped) if end < 0 else end + 1
+
+        count = mapped[start:end].count(b"\n")
+        if mapped[end - 1] != ord("\n"):
+            # The last line doesn't end in a newline.
+            count += 1
+
+        self.found.append(Lazy(mapped, start, end, count))
+
+        return end
+
+    def run(self, start):
+        while start < len(self.mapped):
+            start = self.index(start)
+
+        self.done = True
+
+    def take(self):
+        """Return the blocks found since the last call."""
+        n = len(self.found)
+
+        blocks = self.found[self.taken : n]
+        self.taken = n
+
+        if self.done and n == len(self.found):
+            self.found = []
+            self.taken = 0
+
+        return blocks
+
+
+class Saver:
+    """Writes a buffer to a file in the background.
+
+    The lines are streamed to a temporary file in the same directory, which
+    is synced and renamed over the file, so a failed save leaves the file as
+    it was. Blocks that are still as loaded from a file are copied without
+    being decoded. Others end their lines as the file loaded did.
+
+    A symbolic link is saved through, to the file it links to, and a new file
+    is given the permissions open would give it."""
+
+    def __init__(self, buf, filename):
+        self.filename = filename
+        self.newline = buf.newline
+
+        # Lazy blocks are never changed. Other blocks may be.
+        self.blocks = [b if isinstance(b, Lazy) else list(b) for b in buf.blocks]
+
+        self.total = sum(map(measure, self.blocks))
+        self.written = 0
+
+        self.done = False
+        self.error = None
+
+        # Not a daemon so that exiting waits for the save to finish.
+        threading.Thread(target=self.run).start()
+
+    def progress(self):
+        """Return the percentage written."""
+        return min(100, 100 * self.written // max(1, self.total))
+
+    def run(self):
+        # Imported when needed, to keep startup fast.
+        import tempfile
+
+        path = os.path.realpath(self.filename)
+        directory, name = os.path.split(path)
+
+        newline = self.newline.encode("utf8")
+
+        temporary = None
+        try:
+            fd, temporary = tempfile.mkstemp(prefix=f".{name}.", dir=directory)
+            with os.fdopen(fd, "wb") as file:
+                for block in self.blocks:
+                    if isinstance(block, Lazy):
+                        data = block.mapped[block.start : block.end]
+                        if not data.endswith(b"\n"):
+                            data += newline
+                    elif block:
+                        data = (self.newline.join(block) + self.newline).encode("utf8")
+                    else:
+                        data = b""
+
+                    file.write(data)
+                    self.written += len(data)
+
+                file.flush()
+                os.fsync(file.fileno())
+
+            try:
+                mode = os.stat(path).st_mode
+            except FileNotFoundError:
+                mode = 0o666 & ~umask()
+
+            os.chmod(temporary, mode)
+
+            os.replace(temporary, path)
+            temporary = None
+
+            # Make the rename durable if possible. The file is saved either way.
+            try:
+                fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError:
+                pass
+
+        except Exception as e:
+            # Reported by the main thread, rather than printed over the screen.
+            self.error = e
+
+            if temporary:
+                try:
+                    os.unlink(temporary)
+                except OSError:
+                    pass
+
+        finally:
+            self.done = True
+
 
 # A display chunk.
-Chunk = collections.namedtuple("Chunk", "col sel str")
+Chunk = collections.namedtuple("Chunk", "col sel attr str")
 
 delim = re.compile(rb"\r?\n")
 
+# The decoded lines of the lazy blocks used most recently, and what is cached
+# for each, least recent first.
+recent = collections.OrderedDict()
+
+
+def common(a, b):
+    """Return the length of the common prefix of a and b."""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+
+    return lo
+
 
 def join(lines):
     return "\n".join(lines).encode("utf8")
 
 
+def measure(lines):
+    if isinstance(lines, Lazy):
+        return lines.size
+
+    return sum(map(len, lines)) + len(lines)
+
+
 def split(raw):
     return list(line.expandtabs().decode("utf8") for line in delim.split(raw))
+
+
+def umask():
+    """Return the file mode creation mask, without changing it if possible,
+    as other threads may be creating files."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except OSError:
+        pass
+
+    mask = os.umask(0)
+    os.umask(mask)
+
+    return mask
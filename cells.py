@@ -0,0 +1,129 @@
+"""Display widths.
+
+A character takes two cells if it is wide (like CJK and most emoji), none if
+it combines with the character before it, two for a control character (which
+curses shows as ^X) and one otherwise. Widths are looked up in unicodedata
+once and kept in a table indexed by code point. The column at which each
+character starts is cached for recently used lines, except for lines of
+printable ASCII where columns are indexes."""
+
+import array
+import bisect
+import functools
+import itertools
+import unicodedata
+
+UNKNOWN = 0xFF
+
+# The widths of ASCII characters, for bytes.translate.
+ASCII = bytes(2 if b < 0x20 or b == 0x7F else 1 for b in range(128)) + bytes(128)
+
+# Code point -> width, filled in as characters are seen.
+table = bytearray([UNKNOWN]) * (0x10FFFF + 1)
+
+
+def char(c):
+    """Return the width of character c."""
+    w = table[ord(c)]
+    if w == UNKNOWN:
+        w = table[ord(c)] = measure(c)
+
+    return w
+
+
+def clip(line, start, stop):
+    """Return the part of line shown from column start up to column stop.
+    Halves of wide characters at either end are shown as spaces."""
+    cols = columns(line)
+    if cols is None:
+        return line[start:stop]
+
+    n = len(line)
+
+    stop = min(stop, cols[n])
+    if start >= stop:
+        return ""
+
+    # Characters combined with the one before start are left out with it.
+    i = bisect.bisect_left(cols, start, 0, n)
+    i = bisect.bisect_right(cols, cols[i], 0, n) - 1
+    j = bisect.bisect_right(cols, stop, 0, n + 1) - 1
+
+    return " " * (cols[i] - start) + line[i:j] + " " * (stop - cols[j])
+
+
+def column(line, x):
+    """Return the column at which the character at index x starts. Indexes
+    past the end of the line are one column apart."""
+    cols = columns(line)
+    if cols is None:
+        return x
+
+    n = len(line)
+    if x > n:
+        return cols[n] + x - n
+
+    return cols[x]
+
+
+@functools.lru_cache(maxsize=1 << 8)
+def columns(line):
+    """Return the column at which each character of line starts, and the
+    width of line, or None if every character is one column wide."""
+    if simple(line):
+        return None
+
+    if line.isascii():
+        widths = line.encode("ascii").translate(ASCII)
+    else:
+        for c in set(line):
+            char(c)
+
+        widths = map(table.__getitem__, map(ord, line))
+
+    return array.array("I", itertools.accumulate(widths, initial=0))
+
+
+def index(line, col):
+    """Return the index of the character shown at column col. Columns past
+    the end of the line are one index apart."""
+    cols = columns(line)
+    if cols is None:
+        return col
+
+    n = len(line)
+    if col >= cols[n]:
+        return n + col - cols[n]
+
+    # The last character starting at or before col. Combining characters
+    # start where the next character does, so it is never one of those.
+    return bisect.bisect_right(cols, col, 0, n) - 1
+
+
+def measure(c):
+    if unicodedata.category(c) in ("Mn", "Me", "Cf"):
+        return 0
+
+    if unicodedata.category(c) == "Cc":
+        return 2
+
+    if unicodedata.east_asian_width(c) in ("F", "W"):
+        return 2
+
+    return 1
+
+
+@functools.lru_cache(maxsize=1 << 8)
+def simple(line):
+    """Return whether every character of line is one column wide. This is
+    cached apart from columns so that it is known for a long line without
+    keeping the columns of all of it."""
+    return line.isascii() and line.isprintable()
+
+
+def width(line):
+    cols = columns(line)
+    if cols is None:
+        return len(line)
+
+    return cols[-1]
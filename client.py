@@ -0,0 +1,130 @@
+"""Client - attach to a console run with --serve.
+
+Usage:
+  client.py SOCKET
+
+Options:
+  -h --help  Show this help output.
+
+Keys are sent to the server by name while the shell is reading a command,
+and as bytes while a full screen program runs. ALT+d detaches, leaving the
+sessions running for the next client to attach to.
+
+"""
+import curses
+import os
+import select
+import signal
+import socket
+import sys
+
+import docopt
+
+import cells
+import sgr
+import terminal
+import widget
+import wire
+
+# The key that detaches, while the shell is reading a command.
+DETACH = "ALT+d"
+
+
+def draw(stdscr, value):
+    if value["clear"]:
+        stdscr.clear()
+
+    for y, runs in value["rows"]:
+        x = 0
+        for attr, text in runs:
+            widget.addstr(stdscr, y, x, text, sgr.local(attr))
+            x += cells.width(text)
+
+    try:
+        stdscr.move(*value["cursor"])
+    except curses.error:
+        pass
+
+    stdscr.refresh()
+
+
+def main(stdscr, sock):
+    curses.mouseinterval(0)
+    curses.mousemask(curses.ALL_MOUSE_EVENTS | curses.REPORT_MOUSE_POSITION)
+    curses.raw()
+    stdscr.keypad(1)
+
+    print("\x1b[?1003h", flush=True)
+
+    # Resizes wake select up.
+    r, w = os.pipe()
+    os.set_blocking(w, False)
+    signal.set_wakeup_fd(w)
+    signal.signal(signal.SIGWINCH, lambda signum, frame: None)
+
+    def size():
+        rows, cols = os.get_terminal_size(0)[::-1]
+        curses.resizeterm(rows, cols)
+        sock.sendall(wire.encode(wire.SIZE, [rows, cols]))
+
+    size()
+
+    canonical = True
+    reader = wire.Reader()
+    while True:
+        rfds, _, _ = select.select([sock, 0, r], [], [])
+
+        if r in rfds:
+            os.read(r, 1024)
+            size()
+
+        if sock in rfds:
+            data = sock.recv(1 << 16)
+            if not data:
+                # The server exited.
+                break
+
+            for kind, value in reader.feed(data):
+                if kind == wire.DRAW:
+                    draw(stdscr, value)
+                elif kind == wire.MODE:
+                    canonical = value
+                elif kind == wire.OUTPUT:
+                    sys.stdout.buffer.write(value)
+                    sys.stdout.flush()
+
+        if 0 in rfds:
+            if canonical:
+                key = terminal.key_by_name(stdscr)
+                if key == DETACH:
+                    break
+
+                mouse = None
+                if key == "KEY_MOUSE":
+                    try:
+                        mouse = curses.getmouse()
+                    except curses.error:
+                        continue
+
+                if key not in ("", "KEY_RESIZE"):
+                    sock.sendall(wire.encode(wire.KEY, [key, mouse]))
+            else:
+                sock.sendall(wire.encode(wire.INPUT, os.read(0, 1024)))
+
+    print("\x1b[?1003l", flush=True)
+
+    curses.noraw()
+    curses.flushinp()
+
+
+if __name__ == "__main__":
+    args = docopt.docopt(__doc__)
+
+    os.environ.setdefault("ESCDELAY", "50")
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(args["SOCKET"])
+
+    curses.wrapper(main, sock)
+
+    sock.close()
@@ -2,40 +2,48 @@
 
 import fcntl
 import os
-import pty
+import re
 import select
 import signal
-import struct
 import sys
+import time
 import tty
 
 import debug
+import loop
 import mode
-import options
-import terminal
+import session
+import startup
+import stats
 
 
 # Constants.
 
-# TODO: Replace with escape sequence and also send back pid.
-MULTI_LINE = b"multi-line: bash, type-ahead: "
+# The shell run in each session.
+SHELL = ["bash", "--noediting", "--noprofile", "--norc"]
 
 STDIN_FILENO = 0
 STDOUT_FILENO = 1
 STDERR_FILENO = 2
 
+# The most output to read from a child before handling other events, like
+# key presses.
+DRAIN_LIMIT = 1 << 16
 
-def clear(term, canonical):
-    if canonical:
-        term.stdscr.clear()
+# The most output, in bytes or lines, handled between renders. Past either,
+# children aren't read until the next render, so that the kernel's buffer
+# fills and blocks them rather than output piling up faster than it is shown.
+PENDING_BYTES = 1 << 20
+PENDING_LINES = 1 << 14
 
+# Seconds between checks on work done in the background.
+POLL_INTERVAL = 0.05
 
-def extract_type_ahead(data):
-    idx = data.find(MULTI_LINE)
-    if idx < 0:
-        return data, None
 
-    return data[:idx], remove_suffix(data[idx + len(MULTI_LINE) :], b"\r\n")
+def clear(term, canonical):
+    if canonical:
+        term.stdscr.clear()
+        term.invalidate()
 
 
 def handle_mode_change(term, canonical, fd):
@@ -49,90 +57,404 @@ def handle_mode_change(term, canonical, fd):
     return icanon_set
 
 
+def readable(fd):
+    rfds, _, _ = select.select([fd], [], [], 0)
+    return bool(rfds)
+
+
 def remove_suffix(b, suffix):
     if suffix and b.endswith(suffix):
         return b[: -len(suffix)]
     return b
 
 
+def load():
+    """Import the modules that parse options and run the terminal. This is
+    done after the child is spawned so that its startup overlaps ours."""
+    global options
+    global terminal
+
+    import options
+    import terminal
+
+
 def main(term):
     """Main event loop.
     Handles
-            input from program running in a pseudo-terminal (child_fd);
-            input from the user through the terminal (STDIN_FILENO);
-            special events sent using the self-pipe trick (pfds[0])."""
+            input from the programs running in each session's pseudo-terminal;
+            input from the user through the terminal, or a client (user);
+            special events sent using the self-pipe trick (pfds[0]).
 
-    canonical = True
-    previous = canonical
+    Output is rendered at most once per frame interval. Everything else is
+    rendered immediately. Only the current session is rendered."""
 
-    clear(term, canonical)
-    terminal.resize(child_fd)
+    startup.mark("curses")
 
-    while True:
-        if previous != canonical:
-            clear(term, canonical)
-            previous = canonical
+    # The mode of what was last drawn. None when another session was.
+    previous = True
 
-        if canonical:
-            term.render()
+    interval = int(options.parsed["--frame"]) / 1000
+
+    # The pending render, if any, and when the last render happened.
+    timer = None
+    rendered = 0.0
+
+    # Whether work done in the background is being checked on.
+    polling = False
+
+    # Output handled since the last render, and whether children aren't read
+    # until the next one.
+    pending = lines = 0
+    paused = False
+
+    events = loop.Loop()
+
+    def end(s):
+        """The shell in s exited or hung up."""
+        events.remove(s.fd)
+        s.close()
+
+        current = s is sessions.current
+        sessions.remove(s)
+
+        if not len(sessions):
+            events.stop()
+        elif current:
+            switch()
+
+    def pause():
+        """Stop reading children until the next render."""
+        nonlocal paused
+
+        paused = True
+        stats.count("pauses", 1)
+
+        for s in sessions:
+            events.remove(s.fd)
+
+        # Output from a session that isn't shown isn't rendered otherwise.
+        schedule(False)
 
-        fds = [STDIN_FILENO, child_fd, pfds[0]]
-        rfds, _, xfds = select.select(fds, [], fds)
+    def render():
+        nonlocal lines, paused, pending, previous, rendered, timer
 
-        # debug.log("got something...", rfds, xfds)
+        timer = None
 
-        # NOTE: We avoid continues as there may be other fds to handle.
+        s = sessions.current
+        if previous != s.canonical:
+            clear(s.term, s.canonical)
+            user.mode(s.canonical)
+            previous = s.canonical
 
-        if pfds[0] in rfds:
-            data = read_fd(pfds[0])
-            if data == b"x":
-                break
-            if data == b"r":
-                terminal.resize(child_fd)
+        if s.canonical:
+            start = stats.now()
+            s.term.render()
+            stats.since("render", start)
 
-        if child_fd in xfds:
-            canonical = handle_mode_change(term, canonical, child_fd)
+            rendered = time.monotonic()
+
+            startup.mark("frame")
+            if startup.seen("prompt") and options.parsed["--startup"]:
+                startup.mark("prompt drawn")
+                events.stop()
+
+        pending = lines = 0
+        if paused:
+            paused = False
+            for s in sessions:
+                watch(s)
+
+    def poll():
+        nonlocal polling
+
+        polling = any([s.term.poll() for s in sessions])
+        if polling:
+            events.call_later(POLL_INTERVAL, poll)
+
+        schedule(False)
+
+    def schedule(urgent):
+        nonlocal timer
+
+        if timer:
+            if not urgent:
+                # Output is already waiting for the end of the frame.
+                return
+
+            events.cancel(timer)
+
+        delay = 0
+        if not urgent:
+            delay = max(0, rendered + interval - time.monotonic())
+
+        timer = events.call_later(delay, render)
+
+    def switch():
+        """Show the current session."""
+        nonlocal previous
+
+        s = sessions.current
+        s.term.stdscr = term.stdscr
+
+        if len(sessions) > 1:
+            n = sessions.index(s) + 1
+            s.term.status.message = f"Session {n} of {len(sessions)}"
+
+        previous = None
+        if not s.canonical:
+            # Clear the screen and have the program draw it again.
+            term.stdscr.clear()
+            term.stdscr.refresh()
+            s.redraw()
+
+        schedule(True)
+
+    def update(s, mode):
+        if mode != s.canonical:
+            s.canonical = mode
+            if s is sessions.current:
+                schedule(True)
+
+    def child_exceptional(s):
+        update(s, handle_mode_change(s.term, s.canonical, s.fd))
+
+    def child_read(s):
+        nonlocal lines, pending
+
+        # Drain what the child has written, up to a limit, so that key
+        # presses aren't kept waiting behind a flood of output.
+        total = 0
+        while True:
+            start = stats.now()
+            data, eof = s.reader.read()
+            stats.since("read", start)
 
-        if child_fd in rfds:
-            data, eof = read_child(child_fd)
             if eof:
                 # debug.log("eof")
 
                 # Assume the child process exited or is unreachable.
-                break
+                end(s)
+                return
+
+            total += len(data)
+            stats.count("read bytes", len(data))
+            current, prompted = handle_output(s, data)
+            update(s, current)
+
+            if s is sessions.current:
+                # The prompt is drawn as soon as possible, like a key press.
+                schedule(prompted)
+
+            pending += len(data)
+            lines += data.count(b"\n")
+            if pending > PENDING_BYTES or lines > PENDING_LINES:
+                pause()
+                return
+
+            if s.term.log and s.term.log.behind():
+                # Let the transcript catch up rather than drop output.
+                pause()
+                return
+
+            if total >= DRAIN_LIMIT or not readable(s.fd):
+                return
+
+    def pipe_read(fd):
+        try:
+            data = read_fd(fd)
+        except BlockingIOError:
+            # Drained.
+            return False
+
+        for c in data:
+            if c == ord("x"):
+                for s in sessions:
+                    if s.pid in exited:
+                        end(s)
+
+                if not len(sessions):
+                    return False
+            if c == ord("r"):
+                for s in sessions:
+                    user.resize(s.fd)
+                schedule(True)
+            if c == ord("s"):
+                message = f"Statistics written to {stats.dump()}"
+                sessions.current.term.status.message = message
+                schedule(True)
+
+        return True
+
+    def key_press(s, key, mouse):
+        data, eof = s.term.input(key, mouse)
+        if eof:
+            events.stop()
+            return
+        schedule(True)
+
+        request, s.term.request = s.term.request, None
+        if request == "new":
+            start(s)
+        elif request:
+            sessions.step(1 if request == "next" else -1)
+            switch()
+
+        if not polling:
+            # The key pressed may have started work, like saving a file.
+            poll()
+
+        if data:
+            write_all(s.fd, data)
+
+    def start(s):
+        """Start a new session that wraps like s and make it current."""
+        try:
+            log = transcribe(sessions.started + 1)
+        except (ImportError, OSError) as e:
+            s.term.status.message = f"Transcript failed: {e}"
+            return
+
+        t = terminal.Terminal(
+            lines=int(options.parsed["--lines"]),
+            size=int(options.parsed["--size"]),
+            wrap=s.term.buf.wrap,
+            log=log,
+        )
+
+        sessions.add(session.Session(*session.spawn(SHELL), t))
+        if not paused:
+            watch(sessions.current)
+        user.resize(sessions.current.fd)
 
-            if data:
-                # debug.log("<- ", data)
+        switch()
 
-                data, type_ahead = extract_type_ahead(data)
-                if type_ahead is not None:
-                    canonical = True
+    def watch(s):
+        # Input from the user is handled before output from children.
+        events.add(
+            s.fd,
+            lambda fd: child_read(s),
+            lambda fd: child_exceptional(s),
+            order=2,
+        )
+
+    def user_read():
+        for kind, *args in user.read(sessions.current.canonical):
+            s = sessions.current
+            if kind == "key" and s.canonical:
+                key_press(s, *args)
+                if not events.running:
+                    return
+            elif kind == "input":
+                write_all(s.fd, args[0])
+            elif kind == "size":
+                # A client attached, or its screen was resized.
+                for s in sessions:
+                    user.resize(s.fd)
+                switch()
+
+    events.add(pfds[0], pipe_read, edge=True, order=0)
+    user.watch(events, user_read)
+
+    for s in sessions:
+        watch(s)
+        user.resize(s.fd)
+
+    switch()
+    poll()
+
+    events.run()
+
+
+def handle_output(s, data):
+    """Handle output from the child of session s. Returns the (possibly new)
+    mode and whether the child is waiting for a command."""
+    term, canonical = s.term, s.canonical
+    if not data:
+        return canonical, False
+
+    # debug.log("<- ", data)
+
+    # Output written directly to the terminal, and pieces of text for the
+    # editor with their graphic renditions, in order.
+    raw = []
+    text = []
+
+    prompted = False
+
+    # The mode is checked, a system call, at most once per read. A program
+    # changes it before writing what depends on it.
+    checked = False
+
+    start = stats.now()
+    events = s.parser.feed(data)
+    stats.since("parse", start)
+
+    for event in events:
+        if event.kind == "osc" and event.data.startswith(b"133;"):
+            if text:
+                term.output(text)
+                text = []
 
-                    term.type_ahead(type_ahead)
+            if handle_shell(s, event.data):
+                # The shell is reading a command.
+                canonical = True
+                prompted = True
+        elif not canonical:
+            raw.append(event.raw)
+        elif event.kind == "text":
+            text.append((event.data, term.attr))
+        elif event.kind == "csi" and event.final == b"m":
+            # Graphic renditions apply to the text that follows.
+            term.style(event.params)
+        elif event.kind in ("esc", "csi"):
+            # A full screen program changes mode before it starts drawing.
+            if text:
+                term.output(text)
+                text = []
 
-                    os.kill(pid, signal.SIGCONT)
+            if not checked:
+                canonical = handle_mode_change(term, canonical, s.fd)
+                checked = True
+            if not canonical:
+                raw.append(event.raw)
 
-                if canonical:
-                    # TODO: Parse and look for specific escape codes.
-                    if data.startswith(b"\x1b["):
-                        canonical = handle_mode_change(term, canonical, child_fd)
-                        write_all(STDOUT_FILENO, data)
-                    elif data:
-                        term.output(data)
-                else:
-                    write_all(STDOUT_FILENO, data)
+        # Other sequences are dropped in canonical mode.
 
-        if STDIN_FILENO in rfds:
-            if canonical:
-                data, eof = term.input()
-                if eof:
-                    break
-            else:
-                debug.log("reading stdin...")
-                data = read_fd(STDIN_FILENO)
+    if text:
+        term.output(text)
 
-            if data:
-                write_all(child_fd, data)
+    if raw and s is sessions.current:
+        # Full screen output from other sessions is dropped. The program
+        # redraws when its session is switched to.
+        user.write(b"".join(raw))
+
+    return canonical, prompted
+
+
+def handle_shell(s, data):
+    """Handle a shell integration sequence: OSC 133 ; A (prompt start), B
+    (command input start), C (command start) or D ; status (command end).
+    The shell adds its pid and any type-ahead to the prompt start. Returns
+    True for a prompt start."""
+    kind, *params = data.split(b";")[1:]
+
+    if kind == b"A":
+        startup.mark("prompt")
+
+        fields = dict(p.partition(b"=")[::2] for p in params)
+
+        # Programs can turn echo back on.
+        session.disable_echo(s.fd)
+
+        type_ahead = unquote(fields.get(b"ta", b""))
+        s.term.prompt(int(fields.get(b"aid", s.pid)), remove_suffix(type_ahead, b"\n"))
+
+        return True
+
+    if kind == b"D" and params:
+        s.term.finished(int(params[0]))
+
+    return False
 
 
 def pipe():
@@ -147,16 +469,29 @@ def pipe():
     return p
 
 
-def read_child(fd):
-    # Handle EOF. Whether an empty byte string or OSError.
-    try:
-        data = os.read(fd, 1024)
-        if data:
-            return data[1:], False
-    except OSError:
+class Local:
+    """The terminal the console runs in. Keys are read by the current
+    session's terminal while it is in canonical mode and passed on as bytes
+    otherwise."""
+
+    def mode(self, canonical):
         pass
 
-    return None, True
+    def read(self, canonical):
+        if canonical:
+            return [("key", None, None)]
+
+        debug.log("reading stdin...")
+        return [("input", read_fd(STDIN_FILENO))]
+
+    def resize(self, fd):
+        terminal.resize(fd)
+
+    def watch(self, events, handler):
+        events.add(STDIN_FILENO, lambda fd: handler(), order=1)
+
+    def write(self, data):
+        write_all(STDOUT_FILENO, data)
 
 
 def read_fd(fd):
@@ -166,45 +501,48 @@ def read_fd(fd):
 def sigchld(signum, frame):
     global exitcode
 
-    cpid, status = os.wait()
+    # Signals can be merged, so reap every child that has exited.
+    while True:
+        try:
+            cpid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+
+        if not cpid:
+            break
 
-    # debug.log(f"pid {cpid}, status {status}")
-    if cpid == pid:
-        exitcode = waitstatus_to_exitcode(status)
+        # debug.log(f"pid {cpid}, status {status}")
+        exitcode = exited[cpid] = waitstatus_to_exitcode(status)
         write_all(pfds[1], b"x")
 
 
+def sigusr1(signum, frame):
+    write_all(pfds[1], b"s")
+
+
 def sigwinch(signum, frame):
     write_all(pfds[1], b"r")
 
 
-def spawn(argv):
-    """Create a spawned process."""
-    if type(argv) == type(""):
-        argv = (argv,)
-
-    pid, child_fd = pty.fork()
-    if not pid:
-        # Child.
-        ml = MULTI_LINE.decode("utf8")
-        os.environ["PROMPT_COMMAND"] = "; ".join(
-            (
-                "read -N8192 -t0.01 ta",
-                f'echo "{ml}$ta"',
-                "stty -echo",
-                "kill -sTSTP $$",
-            )
-        )
+def transcribe(n):
+    """Return the transcript for the nth session started, if there is one."""
+    path = options.parsed["--transcript"]
+    if not path:
+        return None
+
+    # Imported when needed, to keep startup fast.
+    import transcript
 
-        os.environ["PS1"] = ""
-        os.environ["PS2"] = ""
+    if n > 1:
+        root, suffix = os.path.splitext(path)
+        path = f"{root}-{n}{suffix}"
 
-        os.execlp(argv[0], *argv)
+    return transcript.Transcript(path, int(options.parsed["--rotate"]))
 
-    # Parent.
-    fcntl.ioctl(child_fd, tty.TIOCPKT, "    ")
 
-    return pid, child_fd
+def unquote(b):
+    """Decode percent-encoded bytes."""
+    return re.sub(rb"%([0-9A-F]{2})", lambda m: bytes([int(m[1], 16)]), b)
 
 
 def waitstatus_to_exitcode(status):
@@ -217,22 +555,83 @@ def waitstatus_to_exitcode(status):
 
 
 def write_all(fd, data):
+    start = stats.now()
+
+    # Slicing a memoryview doesn't copy what remains after a partial write.
+    data = memoryview(data)
     while data:
         n = os.write(fd, data)
         data = data[n:]
 
+    stats.since("write", start)
+
 
 exitcode = 0
 
-pfds = pipe()
+# The exit codes of children that have exited, by pid.
+exited = {}
+
+sessions = session.Sessions()
+
+# The user's terminal, or a server for clients to attach to.
+user = Local()
+
+if __name__ == "__main__":
+    startup.mark("imported")
+
+    pfds = pipe()
+
+    pid, child_fd = session.spawn(SHELL)
 
-pid, child_fd = spawn(["bash", "--noediting", "--noprofile", "--norc"])
+    startup.mark("spawned")
 
-signal.signal(signal.SIGCHLD, sigchld)
-signal.signal(signal.SIGWINCH, sigwinch)
+    signal.signal(signal.SIGCHLD, sigchld)
+    signal.signal(signal.SIGUSR1, sigusr1)
+    signal.signal(signal.SIGWINCH, sigwinch)
+
+    load()
+
+    startup.mark("loaded")
+
+    try:
+        log = transcribe(1)
+    except (ImportError, OSError) as e:
+        sys.exit(f"console.py: {e}")
+
+    term = terminal.Terminal(
+        filename=options.parsed["FILE"],
+        lines=int(options.parsed["--lines"]),
+        size=int(options.parsed["--size"]),
+        wrap=options.parsed["--wrap"],
+        log=log,
+    )
+    sessions.add(session.Session(pid, child_fd, term))
+
+    if options.parsed["--serve"]:
+        # Carry on after the terminal the server was started from is gone.
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        # Imported when needed, to keep startup fast.
+        import server
+
+        try:
+            user = server.Server(options.parsed["--serve"])
+        except OSError as e:
+            sys.exit(f"console.py: {e}")
+        term.stdscr = user.screen
+
+        main(term)
+
+        user.close()
+    else:
+        term.run(main)
 
-terminal.Terminal(filename=options.parsed["FILE"]).run(main)
+    for s in sessions:
+        s.close()
 
-os.close(child_fd)
+    if options.parsed["--startup"]:
+        # The shell was hung up on, and how it exited doesn't matter.
+        startup.report()
+        sys.exit(0)
 
-sys.exit(exitcode)
+    sys.exit(exitcode)
@@ -1,19 +1,89 @@
+"""Debug logging.
+
+Logging is off by default and a call that won't log returns after comparing
+levels. Arguments are formatted, like print, by a background writer, so pass
+values, not formatted strings, and don't pass values that will change."""
+
+import atexit
 import sys
+import time
+
+import writer
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+level = OFF
+
+output = None
+
+
+def error(*args):
+    if level <= ERROR:
+        output.put((time.time(), ERROR, args))
+
+
+def close():
+    if output:
+        output.close()
+
+
+def format(record):
+    when, severity, args = record
 
+    stamp = time.strftime("%H:%M:%S", time.localtime(when))
+    millis = int(when % 1 * 1000)
 
-logging = True
+    return f"{stamp}.{millis:03} {NAMES[severity]} {' '.join(map(str, args))}\n"
 
 
-def log(*args, **kwargs):
-    if not logging:
+def info(*args):
+    if level <= INFO:
+        output.put((time.time(), INFO, args))
+
+
+def log(*args):
+    if level <= DEBUG:
+        output.put((time.time(), DEBUG, args))
+
+
+def on(flag=True, path="-", threshold=DEBUG):
+    """Log messages at or above threshold to path (- for stderr), if flag is
+    set. Otherwise turn logging off."""
+    global level
+    global output
+
+    level = OFF
+
+    close()
+    output = None
+
+    if not flag:
         return
 
-    kwargs["file"] = sys.stderr
-    kwargs["flush"] = True
+    f = sys.stderr if path == "-" else open(path, "a")
+
+    def write(batch, dropped):
+        if dropped:
+            f.write(f"[{dropped} messages dropped]\n")
+
+        f.write("".join(map(format, batch)))
+        f.flush()
+
+    output = writer.Writer(write)
+    output.start()
+
+    level = threshold
+
 
-    print(*args, **kwargs)
+atexit.register(close)
 
 
-def on(flag=True):
-    global logging
-    logging = flag
+def warning(*args):
+    if level <= WARNING:
+        output.put((time.time(), WARNING, args))
@@ -0,0 +1,113 @@
+"""Soft wrapping of lines into rows of at most width columns.
+
+Positions on screen are found by walking rows out from a line that is on
+screen, like the cursor's, so the cost depends on the number of rows walked
+and not on the number of lines in the buffer. The number of rows in each line
+of a block is cached with the block, for each width, and discarded when the
+block changes.
+
+A wide character that doesn't fit at the end of a row starts the next row,
+so the rows of lines that aren't simple are found from their columns."""
+
+import bisect
+import functools
+
+import cells
+
+
+def count(text, y, width):
+    """Return the number of rows in line y of text."""
+    b, i = text.locate(y)
+    return text.cached(b, ("rows", width), lambda lines: counts(lines, width))[i]
+
+
+def counts(lines, width):
+    return [rows(line, width) for line in lines]
+
+
+def index(line, r, c, width):
+    """Return the position shown at column c of row r of line."""
+    return cells.index(line, start(line, r, width) + c)
+
+
+def place(line, x, width):
+    """Return the row, and column in that row, of position x in line."""
+    if cells.simple(line):
+        r, c = divmod(x, width)
+    else:
+        s = starts(line, width)
+        r = bisect.bisect_right(s, x) - 1
+        c = cells.column(line, x) - cells.column(line, s[r])
+
+    if c >= width or r and r == rows(line, width):
+        # The end of a line that fills its last row.
+        return rows(line, width) - 1, width - 1
+
+    return r, c
+
+
+def rows(line, width):
+    if cells.simple(line):
+        return max(1, -(-len(line) // width))
+
+    return len(starts(line, width))
+
+
+def start(line, r, width):
+    """Return the column at which row r of line starts."""
+    if cells.simple(line):
+        return r * width
+
+    s = starts(line, width)
+    if r < len(s):
+        return cells.column(line, s[r])
+
+    return cells.width(line) + (r - len(s)) * width
+
+
+@functools.lru_cache(maxsize=1 << 10)
+def starts(line, width):
+    """Return the position at which each row of line starts."""
+    cols = cells.columns(line)
+
+    s = [0]
+    for x in range(len(line)):
+        if cols[x + 1] - cols[s[-1]] > width and cols[x] > cols[s[-1]]:
+            s.append(x)
+
+    return s
+
+
+def walk(text, y, r, n, width):
+    """Move n rows down, or up if n is negative, from row r of line y.
+    Returns the line and row reached and the number of rows moved, which is
+    less than abs(n) if the start or end of the text was reached."""
+    moved = 0
+
+    if n >= 0:
+        while moved < n:
+            step = min(n - moved, count(text, y, width) - 1 - r)
+            r += step
+            moved += step
+
+            if moved == n or y + 1 >= len(text):
+                break
+
+            y += 1
+            r = 0
+            moved += 1
+    else:
+        n = -n
+        while moved < n:
+            step = min(n - moved, r)
+            r -= step
+            moved += step
+
+            if moved == n or y == 0:
+                break
+
+            y -= 1
+            r = count(text, y, width) - 1
+            moved += 1
+
+    return y, r, moved
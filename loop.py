@@ -0,0 +1,115 @@
+import collections
+import heapq
+import itertools
+import select
+import time
+
+# Events that mean a file descriptor should be read. A hang up or error is
+# reported to the read handler which will then see EOF or an error.
+READ = select.POLLIN | select.POLLHUP | select.POLLERR
+
+
+class Loop:
+    """An event loop.
+
+    File descriptors are registered, once, with handlers and polled with
+    epoll, or poll where epoll is not available. Timers are kept in a heap."""
+
+    def __init__(self):
+        if hasattr(select, "epoll"):
+            self.poller = select.epoll()
+            self.scale = 1
+        else:
+            self.poller = select.poll()
+            self.scale = 1000
+
+        # File descriptor -> Handler.
+        self.handlers = {}
+
+        self.running = False
+        self.sequence = itertools.count()
+        self.timers = []
+
+    def add(self, fd, read, exceptional=None, edge=False, order=0):
+        """Call read(fd) when fd is readable and exceptional(fd) when an
+        exceptional condition, like a pseudo-terminal mode change, occurs.
+
+        Edge-triggered handlers must drain fd. They are called until they
+        return False. Handlers for events that occur together are called in
+        ascending order."""
+        mask = select.POLLIN
+        if exceptional:
+            mask |= select.POLLPRI
+        if edge and self.scale == 1:
+            mask |= select.EPOLLET
+
+        self.handlers[fd] = Handler(read, exceptional, edge, order)
+        self.poller.register(fd, mask)
+
+    def call_at(self, when, callback):
+        timer = [when, next(self.sequence), callback]
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def call_later(self, delay, callback):
+        return self.call_at(time.monotonic() + delay, callback)
+
+    def cancel(self, timer):
+        # Cancelled timers are discarded when they reach the top of the heap.
+        timer[2] = None
+
+    def remove(self, fd):
+        if self.handlers.pop(fd, None):
+            self.poller.unregister(fd)
+
+    def run(self):
+        self.running = True
+        while self.running:
+            timeout = self.timeout()
+            events = self.poller.poll(timeout)
+
+            events = sorted(events, key=lambda e: self.order(e[0]))
+            for fd, mask in events:
+                if not self.running:
+                    break
+
+                handler = self.handlers.get(fd)
+                if not handler:
+                    continue
+
+                if mask & select.POLLPRI and handler.exceptional:
+                    handler.exceptional(fd)
+
+                if mask & READ and fd in self.handlers:
+                    while handler.read(fd) and handler.edge and self.running:
+                        pass
+
+            now = time.monotonic()
+            while self.running and self.timers and self.timers[0][0] <= now:
+                _, _, callback = heapq.heappop(self.timers)
+                if callback:
+                    callback()
+
+    def order(self, fd):
+        handler = self.handlers.get(fd)
+        return handler.order if handler else 0
+
+    def stop(self):
+        self.running = False
+
+    def timeout(self):
+        while self.timers and self.timers[0][2] is None:
+            heapq.heappop(self.timers)
+
+        if not self.timers:
+            return -1 if self.scale == 1 else None
+
+        delay = max(0, self.timers[0][0] - time.monotonic())
+        if self.scale == 1:
+            return delay
+
+        return int(delay * self.scale + 0.999)
+
+
+# The handlers registered for a file descriptor.
+Handler = collections.namedtuple("Handler", "read exceptional edge order")
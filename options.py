@@ -1,12 +1,33 @@
 """Console - a less surprising terminal experience.
 
 Usage:
-  console.py [-d] [FILE]
+  console.py [options] [FILE]
+  console.py --serve=SOCKET [options]
 
 Options:
-  -h --help     Show this help output.
-  --version     Show version.
-  -d --debug    Debug mode. (Log to stderr).
+  -h --help         Show this help output.
+  --version         Show version.
+  -d --debug        Debug mode. (Log debug messages).
+  -L --log=PATH     Where to log debug messages, - for stderr.
+                    [default: -]
+  -S --startup      Exit once the first prompt is drawn and report how long
+                    each step of startup took.
+  -w --wrap         Wrap long lines instead of scrolling them.
+  -f --frame=MS     Minimum milliseconds between renders of output.
+                    [default: 16]
+  -l --lines=LINES  Scrollback limit in lines, or 0 for none.
+                    [default: 100000]
+  -s --size=BYTES   Scrollback limit in bytes, or 0 for none.
+                    [default: 67108864]
+  --serve=SOCKET    Run without a terminal, for client.py to attach to
+                    through the Unix socket SOCKET.
+  -t --transcript=PATH
+                    Log the output and commands of each session to PATH,
+                    compressed if PATH ends in .gz or .zst. Later sessions
+                    log to numbered files, like log-2.gz for log.gz.
+  -r --rotate=BYTES Start a transcript again once it reaches BYTES, keeping
+                    the last four, numbered like log.1.gz, or 0 for never.
+                    [default: 0]
 
 """
 import docopt
@@ -15,4 +36,4 @@ import debug
 
 parsed = docopt.docopt(__doc__, version="Console 0.1")
 
-debug.on(parsed.pop("--debug", False))
+debug.on(parsed.pop("--debug", False), parsed.pop("--log", "-"))
@@ -1,3 +1,6 @@
+import os
+
+import buffer
 import debug
 
 
@@ -6,12 +9,29 @@ def exit(terminal):
     return yes(terminal.status.command())
 
 
-def forward_search(terminal):
-    text = terminal.status.command()
-    if terminal.editing:
-        terminal.buf.goto_text(text)
+def export(terminal):
+    """Write the scrollback to a file in the background. A relative name is
+    relative to the shell's working directory."""
+    filename = terminal.status.command()
+    if not filename:
+        return False
+
+    filename = resolve(terminal, filename)
+    directory = os.path.dirname(filename)
+
+    buf = terminal.buf
+    if buf.loader or buf.saver:
+        terminal.status.message = "Export failed: still loading or saving"
+    elif not os.path.isdir(directory):
+        terminal.status.message = f"Export failed: no directory {directory}"
     else:
-        terminal.cli.goto_text(text)
+        buf.saver = buffer.Saver(buf.text, filename)
+
+    return False
+
+
+def forward_search(terminal):
+    search(terminal, terminal.status.command(), 1)
 
     return False
 
@@ -30,11 +50,7 @@ def line_number(terminal):
 
 
 def reverse_search(terminal):
-    text = terminal.status.command()
-    if terminal.editing:
-        terminal.buf.goto_text(text, -1)
-    else:
-        terminal.cli.goto_text(text, -1)
+    search(terminal, terminal.status.command(), -1)
 
     return False
 
@@ -55,5 +71,28 @@ def natural(s):
         return 0
 
 
+def resolve(terminal, filename):
+    """Return the absolute path of filename, relative to the working
+    directory of the shell if it is known, or else the console's."""
+    filename = os.path.expanduser(filename)
+
+    cwd = os.getcwd()
+    if terminal.shell:
+        try:
+            cwd = os.readlink(f"/proc/{terminal.shell}/cwd")
+        except OSError:
+            pass
+
+    return os.path.join(cwd, filename)
+
+
+def search(terminal, text, by, skip=False):
+    terminal.query = text
+    if terminal.editing:
+        terminal.buf.goto_text(text, by, skip)
+    else:
+        terminal.cli.goto_text(text, by, skip)
+
+
 def yes(s):
     return s.lower()[:1] == "y"
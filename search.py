@@ -0,0 +1,136 @@
+"""Searches a Buffer.
+
+Each block of lines is searched as a single string so that a block without a
+match is skipped with one call. The string is cached with the block until
+the block changes. Appending output only invalidates the last block.
+
+A query starting with "/" is a regular expression. A query without upper
+case letters ignores case."""
+
+import functools
+import re
+
+import buffer
+
+
+class Query:
+    def __init__(self, text):
+        # Whether case is ignored.
+        self.fold = not any(c.isupper() for c in text)
+
+        flags = re.IGNORECASE if self.fold else 0
+
+        # Plain queries use str.find, on lower case text if case is ignored.
+        self.literal = None
+
+        if text.startswith("/") and len(text) > 1:
+            try:
+                # Blocks are searched as one string. Anchors match at lines.
+                self.pattern = re.compile(text[1:], flags | re.MULTILINE)
+                return
+            except re.error:
+                # Search for the query as written.
+                pass
+
+        self.literal = text.lower() if self.fold else text
+        self.pattern = re.compile(re.escape(text), flags)
+
+    def first(self, text, start, end, folded):
+        """Return the index of the first match in text[start:end] or -1."""
+        if self.literal is not None and folded == self.fold:
+            return text.find(self.literal, start, end)
+
+        m = self.pattern.search(text, start, end)
+        return m.start() if m else -1
+
+    def haystack(self, buf, b):
+        """Return the text of block b and whether it is in lower case."""
+        if self.fold and self.literal is not None:
+            text = buf.cached(b, "folded", fold)
+            if text is not None:
+                return text, True
+
+        return buf.cached(b, "text", "\n".join), False
+
+    def last(self, text, start, end, folded):
+        """Return the index of the last match in text[start:end] or -1."""
+        if self.literal is not None and folded == self.fold:
+            return text.rfind(self.literal, start, end)
+
+        idx = -1
+        for m in self.pattern.finditer(text, start, end):
+            idx = m.start()
+
+        return idx
+
+
+def find(buf, query, x, y, by=1):
+    """Return the position of the first match at or after x, y if by is
+    positive, otherwise of the last match ending before x, y, or None."""
+    line, folded = buf[y], False
+    if query.fold and query.literal is not None:
+        lower = fold([line])
+        if lower is not None:
+            line, folded = lower, True
+
+    if by > 0:
+        idx = query.first(line, x, len(line), folded)
+    else:
+        idx = query.last(line, 0, x, folded)
+
+    if idx >= 0:
+        return idx, y
+
+    b, i = buf.locate(y)
+
+    if by > 0:
+        # Search from the start of the next line to the end of the buffer.
+        start = buffer.measure(buf.blocks[b][: i + 1])
+        while b < len(buf.blocks):
+            text, folded = query.haystack(buf, b)
+
+            idx = query.first(text, start, len(text), folded)
+            if idx >= 0:
+                return position(buf, b, text, idx)
+
+            b += 1
+            start = 0
+
+    else:
+        # Search from the end of the previous line to the start of the buffer.
+        end = buffer.measure(buf.blocks[b][:i]) - 1
+        while b >= 0:
+            text, folded = query.haystack(buf, b)
+
+            idx = query.last(text, 0, end, folded) if end >= 0 else -1
+            if idx >= 0:
+                return position(buf, b, text, idx)
+
+            b -= 1
+            end = len(query.haystack(buf, b)[0]) if b >= 0 else -1
+
+    return None
+
+
+def fold(lines):
+    """Return lines, joined and in lower case, or None if that changes the
+    length of the text, so that indices in one are not indices in the other."""
+    text = "\n".join(lines)
+
+    folded = text.lower()
+    if len(folded) != len(text):
+        return None
+
+    return folded
+
+
+def position(buf, b, text, idx):
+    y = buf.start(b) + text.count("\n", 0, idx)
+    x = idx - text.rfind("\n", 0, idx) - 1
+
+    return x, y
+
+
+@functools.lru_cache(maxsize=16)
+def query(text):
+    return Query(text)
@@ -0,0 +1,302 @@
+"""Server.
+
+The console can run without a terminal, keeping its sessions, their panels
+and scrollback in this process, for a client (client.py) to attach to over a
+Unix socket. Panels are drawn on a Screen, which sends the rows changed by
+each render to the client rather than the lines behind them, so attaching
+takes time in proportion to the screen however much scrollback there is.
+Scrolling back is done here, like any other key, and sends only the rows it
+changes. If the client goes away the sessions carry on until another one
+attaches. Messages to a client that isn't reading are held back, up to a
+limit, so that it never stops the event loop; past the limit the client is
+detached."""
+
+import curses
+import errno
+import fcntl
+import os
+import socket
+import stat
+import struct
+import tty
+
+import cells
+import debug
+import sgr
+import wire
+
+# The size of the screen until a client says otherwise.
+ROWS = 24
+COLS = 80
+
+# The most bytes held back for a client that isn't reading.
+PENDING = 1 << 23
+
+# Seconds between tries to send what was held back.
+RETRY = 0.01
+
+
+class Screen:
+    """A stand-in for a curses window that keeps what is drawn on it and
+    sends the rows changed since the last refresh to the client."""
+
+    def __init__(self, server):
+        self.server = server
+
+        self.resize(ROWS, COLS)
+
+    def addstr(self, y, x, s, attr=0):
+        if not 0 <= y < self.rows or not 0 <= x < self.cols:
+            # Like curses.
+            raise curses.error("addstr() returned ERR")
+
+        chars = self.chars[y]
+        attrs = self.attrs[y]
+
+        for c in s:
+            w = cells.char(c)
+            if not w:
+                # Combining characters are kept with the one before them.
+                if x:
+                    chars[x - 1] += c
+                continue
+
+            if x + w > self.cols:
+                break
+
+            # Half of a wide character that is drawn over is blanked.
+            if not chars[x]:
+                chars[x - 1] = " "
+            if x + w < self.cols and not chars[x + w]:
+                chars[x + w] = " "
+
+            chars[x] = c
+            attrs[x] = attr
+            if w > 1:
+                # The second half of a wide character.
+                chars[x + 1] = ""
+                attrs[x + 1] = attr
+
+            x += w
+
+        self.damaged.add(y)
+
+    def clear(self):
+        self.resize(self.rows, self.cols)
+
+    def draw(self):
+        """Return the draw message for what changed."""
+        rows = []
+        for y in sorted(self.damaged):
+            runs = []
+            for c, attr in zip(self.chars[y], self.attrs[y]):
+                if runs and runs[-1][0] == attr:
+                    runs[-1][1] += c
+                else:
+                    runs.append([attr, c])
+
+            rows.append([y, runs])
+
+        return {"clear": self.cleared, "rows": rows, "cursor": self.cursor}
+
+    def getmaxyx(self):
+        return self.rows, self.cols
+
+    def keypad(self, flag):
+        pass
+
+    def move(self, y, x):
+        self.cursor = [y, x]
+
+    def refresh(self):
+        if self.server.client:
+            self.server.send(wire.DRAW, self.draw())
+
+        self.damaged = set()
+        self.cleared = False
+
+    def resize(self, rows, cols):
+        """Resize, and clear, the screen."""
+        self.rows = rows
+        self.cols = cols
+
+        self.chars = [[" "] * cols for _ in range(rows)]
+        self.attrs = [[0] * cols for _ in range(rows)]
+
+        self.cursor = [0, 0]
+
+        # Everything is sent on the next refresh, to a screen cleared first.
+        self.damaged = set(range(rows))
+        self.cleared = True
+
+
+class Server:
+    """The terminal of a console run as a server: a Unix socket at path that
+    one client at a time attaches to. A client that attaches detaches the
+    last one."""
+
+    def __init__(self, path):
+        self.path = path
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.listener.bind(path)
+        except OSError as e:
+            if e.errno != errno.EADDRINUSE or not stale(path):
+                self.listener.close()
+                raise
+
+            # Left by a server that didn't exit cleanly.
+            os.unlink(path)
+            self.listener.bind(path)
+        self.listener.listen()
+        self.listener.setblocking(False)
+
+        self.client = None
+        self.reader = None
+
+        # What couldn't be sent yet, and the timer to try again.
+        self.pending = bytearray()
+        self.retry = None
+
+        self.screen = Screen(self)
+
+        # Whether the current session was last in canonical mode.
+        self.canonical = True
+
+        # Colors are allocated by the client.
+        sgr.remote = True
+
+    def accept(self, fd):
+        try:
+            client, _ = self.listener.accept()
+        except BlockingIOError:
+            return
+
+        self.detach()
+        debug.log("client attached")
+
+        client.setblocking(False)
+        self.client = client
+        self.reader = wire.Reader()
+
+        self.events.add(client.fileno(), lambda fd: self.handler(), order=1)
+
+        self.send(wire.MODE, self.canonical)
+
+    def close(self):
+        self.detach()
+        self.listener.close()
+
+        os.unlink(self.path)
+
+    def detach(self):
+        if not self.client:
+            return
+
+        debug.log("client detached")
+
+        self.events.remove(self.client.fileno())
+        self.client.close()
+        self.client = None
+
+        self.pending = bytearray()
+        if self.retry:
+            self.events.cancel(self.retry)
+            self.retry = None
+
+    def flush(self):
+        """Send what was held back, as much as the client takes."""
+        self.retry = None
+        if not self.client:
+            return
+
+        try:
+            n = self.client.send(self.pending)
+        except BlockingIOError:
+            n = 0
+        except OSError:
+            self.detach()
+            return
+
+        del self.pending[:n]
+        if self.pending:
+            self.retry = self.events.call_later(RETRY, self.flush)
+
+    def mode(self, canonical):
+        self.canonical = canonical
+        self.send(wire.MODE, canonical)
+
+    def read(self, canonical):
+        """Return the input from the client: ("key", name, mouse), ("input",
+        data) or ("size",) when the client's screen was resized."""
+        try:
+            data = self.client.recv(1 << 16)
+        except BlockingIOError:
+            return []
+        except OSError:
+            data = b""
+
+        if not data:
+            # The client went away. The sessions carry on without it.
+            self.detach()
+            return []
+
+        inputs = []
+        for kind, value in self.reader.feed(data):
+            if kind == wire.KEY:
+                inputs.append(("key", *value))
+            elif kind == wire.INPUT:
+                inputs.append(("input", value))
+            elif kind == wire.SIZE:
+                self.screen.resize(*value)
+                inputs.append(("size",))
+
+        return inputs
+
+    def resize(self, fd):
+        """Give the pseudo-terminal fd the size of the client's screen."""
+        size = struct.pack("HHHH", self.screen.rows, self.screen.cols, 0, 0)
+        fcntl.ioctl(fd, tty.TIOCSWINSZ, size)
+
+    def send(self, kind, value):
+        if not self.client:
+            return
+
+        self.pending += wire.encode(kind, value)
+        if len(self.pending) > PENDING:
+            debug.log("client not reading")
+            self.detach()
+        elif not self.retry:
+            self.flush()
+
+    def watch(self, events, handler):
+        """Call handler when there is input from a client, using events."""
+        self.events = events
+        self.handler = handler
+
+        events.add(self.listener.fileno(), self.accept, order=1)
+
+    def write(self, data):
+        self.send(wire.OUTPUT, data)
+
+
+def stale(path):
+    """Return whether path is a socket that no server is listening on."""
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return False
+    except OSError:
+        return False
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+    return False
@@ -0,0 +1,173 @@
+"""Sessions.
+
+Each session is a shell on its own pseudo-terminal, with its own panels and
+parser state. All sessions are served by one event loop but only the current
+session is drawn and sent keys. Output from other sessions is added to their
+panels as it arrives, so an idle session costs little more than its
+scrollback."""
+
+import fcntl
+import os
+import pty
+import struct
+import tty
+
+import vt
+
+# Characters in type-ahead that the shell percent-encodes so that they can
+# be sent in an escape sequence, whose parameters are separated by ";".
+ENCODED = "%;\a\t\n\r\x18\x1a\x1b"
+
+# The range of sizes for reads from the child.
+MIN_READ = 1 << 10
+MAX_READ = 1 << 16
+
+# Reads are copied out as soon as they are made so every reader shares one
+# buffer. One extra byte for the packet mode control byte.
+view = memoryview(bytearray(MAX_READ + 1))
+
+
+class Reader:
+    """Reads output from a pseudo-terminal in packet mode into a preallocated
+    buffer. The read size doubles while reads fill it and halves when reads
+    use less than a quarter of it."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.size = MIN_READ
+
+    def read(self):
+        # Handle EOF. Whether an empty byte string or OSError.
+        try:
+            n = os.readv(self.fd, [view[: self.size + 1]])
+        except OSError:
+            return None, True
+
+        if not n:
+            return None, True
+
+        if n > self.size:
+            self.size = min(self.size * 2, MAX_READ)
+        elif n < self.size // 4:
+            self.size = max(self.size // 2, MIN_READ)
+
+        return bytes(view[1:n]), False
+
+
+class Session:
+    def __init__(self, pid, fd, term):
+        self.pid = pid
+        self.fd = fd
+
+        self.term = term
+
+        # Whether the pseudo-terminal was in canonical mode when last checked.
+        self.canonical = True
+
+        self.parser = vt.Parser()
+        self.reader = Reader(fd)
+
+    def close(self):
+        os.close(self.fd)
+
+        if self.term.log:
+            self.term.log.close()
+
+    def redraw(self):
+        """Have a full screen program redraw by changing the window size and
+        changing it back."""
+        zero = struct.pack("HHHH", 0, 0, 0, 0)
+        size = fcntl.ioctl(self.fd, tty.TIOCGWINSZ, zero)
+        rows, cols, x, y = struct.unpack("HHHH", size)
+
+        wider = struct.pack("HHHH", rows, cols + 1, x, y)
+        fcntl.ioctl(self.fd, tty.TIOCSWINSZ, wider)
+        fcntl.ioctl(self.fd, tty.TIOCSWINSZ, size)
+
+
+class Sessions:
+    """The sessions, in the order they were started, and the current one."""
+
+    def __init__(self):
+        self.current = None
+        self.sessions = []
+
+        # The number of sessions ever added.
+        self.started = 0
+
+    def __iter__(self):
+        # A copy, so that sessions can be removed while iterating.
+        return iter(list(self.sessions))
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def add(self, s):
+        """Add s and make it current."""
+        self.sessions.append(s)
+        self.current = s
+
+        self.started += 1
+
+    def index(self, s):
+        return self.sessions.index(s)
+
+    def remove(self, s):
+        """Remove s. If s was current the session before it becomes current."""
+        i = self.sessions.index(s)
+        del self.sessions[i]
+
+        if self.current is s:
+            self.current = self.sessions[i - 1] if self.sessions else None
+
+    def step(self, n):
+        """Make the session n after the current one current."""
+        i = self.sessions.index(self.current) + n
+        self.current = self.sessions[i % len(self.sessions)]
+
+
+def disable_echo(fd):
+    attrs = tty.tcgetattr(fd)
+    if attrs[3] & tty.ECHO:
+        attrs[3] &= ~tty.ECHO
+        tty.tcsetattr(fd, tty.TCSANOW, attrs)
+
+
+def spawn(argv):
+    """Create a spawned process."""
+    if type(argv) == type(""):
+        argv = (argv,)
+
+    pid, child_fd = pty.fork()
+    if not pid:
+        # Child.
+
+        # Everything here is a builtin so a prompt doesn't start processes,
+        # or wait, and only reads when there is type-ahead.
+        encode = [
+            f"__ta=${{__ta//$'\\x{ord(c):02x}'/%{ord(c):02X}}}" for c in ENCODED
+        ]
+        os.environ["PROMPT_COMMAND"] = "; ".join(
+            (
+                "__s=$? __ta= __c=",
+                "while read -t0",
+                "do IFS= read -r -d '' -N8192 -t0.001 __c",
+                "__ta+=$__c",
+                "done",
+                *encode,
+                "printf '\\e]133;D;%s\\a\\e]133;A;aid=%s;ta=%s\\a' $__s $$ \"$__ta\"",
+            )
+        )
+
+        os.environ["PS0"] = "\\e]133;C\\a"
+        os.environ["PS1"] = "\\[\\e]133;B\\a\\]"
+        os.environ["PS2"] = ""
+
+        os.execlp(argv[0], *argv)
+
+    # Parent.
+    fcntl.ioctl(child_fd, tty.TIOCPKT, "    ")
+
+    disable_echo(child_fd)
+
+    return pid, child_fd
@@ -0,0 +1,251 @@
+"""Graphic renditions.
+
+Select Graphic Rendition (SGR) parameters are folded into an attribute, an
+int holding flags and a foreground and background color. The rendition of a
+line is stored as runs, an array of offset, attribute pairs giving the
+attribute from each offset on, or None if the whole line is plain. Curses
+color pairs are allocated as they are first needed."""
+
+import array
+import bisect
+import curses
+import functools
+
+BOLD = 1
+DIM = 2
+ITALIC = 4
+UNDERLINE = 8
+BLINK = 16
+REVERSE = 32
+
+# Colors are stored plus one, so that zero is the default, in 9 bits each.
+FG = 8
+BG = 17
+COLOR = 0x1FF
+
+# Parameters that set and clear flags.
+SET = {1: BOLD, 2: DIM, 3: ITALIC, 4: UNDERLINE, 5: BLINK, 6: BLINK, 7: REVERSE}
+CLEAR = {21: BOLD, 22: BOLD | DIM, 23: ITALIC, 24: UNDERLINE, 25: BLINK, 27: REVERSE}
+
+# Flags and the curses attributes they are shown with.
+FLAGS = (
+    (BOLD, curses.A_BOLD),
+    (DIM, curses.A_DIM),
+    (ITALIC, getattr(curses, "A_ITALIC", 0)),
+    (UNDERLINE, curses.A_UNDERLINE),
+    (BLINK, curses.A_BLINK),
+    (REVERSE, curses.A_REVERSE),
+)
+
+# Color pair attributes by foreground and background, allocated as first used.
+pairs = {}
+
+# Colors shown by a client are passed to it in the bits above curses's
+# attributes, for it to allocate its own pairs. See server.py.
+REMOTE = 32
+
+# Whether colors are shown by a client.
+remote = False
+
+
+def apply(attr, params):
+    """Return attr changed by the SGR parameters params."""
+    if params[:1] in (b"<", b"=", b">", b"?"):
+        # Private sequences, like xterm's key modifier options, aren't SGR.
+        return attr
+
+    groups = params.split(b";")
+
+    i = 0
+    while i < len(groups):
+        # A parameter can have sub-parameters separated by colons.
+        values = numbers(groups[i].split(b":"))
+        p = values[0]
+        i += 1
+
+        if p == 0:
+            attr = 0
+        elif p in SET:
+            attr |= SET[p]
+        elif p in CLEAR:
+            attr &= ~CLEAR[p]
+        elif 30 <= p <= 37 or 90 <= p <= 97:
+            attr = color(attr, FG, p % 10 + (8 if p >= 90 else 0))
+        elif 40 <= p <= 47 or 100 <= p <= 107:
+            attr = color(attr, BG, p % 10 + (8 if p >= 100 else 0))
+        elif p == 39:
+            attr = color(attr, FG, -1)
+        elif p == 49:
+            attr = color(attr, BG, -1)
+        elif p in (38, 48):
+            values = values[1:]
+            if not values:
+                # The older form, with the color in the parameters that follow.
+                n = 2 if groups[i : i + 1] == [b"5"] else 4
+                values = numbers(groups[i : i + n])
+                i += n
+            elif values[0] == 2 and len(values) > 4:
+                # The color space, which is ignored.
+                del values[1]
+
+            c = extended(values)
+            if c is not None:
+                attr = color(attr, FG if p == 38 else BG, c)
+
+    return attr
+
+
+def at(runs, x):
+    """Return the attribute at offset x of a line with runs."""
+    if not runs:
+        return 0
+
+    i = bisect.bisect_right(runs[::2], x) - 1
+
+    return runs[2 * i + 1] if i >= 0 else 0
+
+
+@functools.lru_cache(maxsize=None)
+def attributes(attr):
+    """Return the curses attributes that attr is shown with."""
+    a = 0
+    for flag, value in FLAGS:
+        if attr & flag:
+            a |= value
+
+    fg = (attr >> FG & COLOR) - 1
+    bg = (attr >> BG & COLOR) - 1
+    if fg >= 0 or bg >= 0:
+        a |= pair(fg, bg)
+
+    return a
+
+
+def color(attr, shift, c):
+    return attr & ~(COLOR << shift) | (c + 1) << shift
+
+
+def cut(runs, x):
+    """Return the runs of the part of a line with runs from offset x on."""
+    if not runs:
+        return None
+
+    return normal([(0, at(runs, x))] + [(o - x, a) for o, a in offsets(runs) if o > x])
+
+
+def extend(runs, x, attr):
+    """Return runs changed so that attr applies from offset x on. Runs are
+    copied, not changed, as they may be shared."""
+    if at(runs, x) == attr:
+        return runs
+
+    runs = array.array("I", runs or ())
+    if runs and runs[-2] == x:
+        # Nothing was shown in the attribute replaced.
+        del runs[-2:]
+        if at(runs, x) == attr:
+            return runs or None
+
+    runs.extend((x, attr))
+
+    return runs
+
+
+def extended(values):
+    """Return an extended color, 5;index or 2;red;green;blue, as an index
+    into the 256 color palette."""
+    if values[:1] == [5] and len(values) > 1:
+        return min(values[1], 255)
+
+    if values[:1] == [2] and len(values) > 3:
+        r, g, b = (min(v, 255) * 5 // 255 for v in values[1:4])
+        return 16 + 36 * r + 6 * g + b
+
+    return None
+
+
+def fit(c):
+    """Return the nearest color to c that the terminal has."""
+    colors = getattr(curses, "COLORS", 8)
+    if c < colors:
+        return c
+
+    if c < 16:
+        return c - 8
+
+    if c < 232:
+        # The 6x6x6 color cube. Each component is on or off.
+        c -= 16
+        r, g, b = c // 36, c // 6 % 6, c % 6
+        return (r > 2) | (g > 2) << 1 | (b > 2) << 2
+
+    # The gray scale.
+    return 7 if c >= 244 else 0
+
+
+def join(a, n, b):
+    """Return the runs of the first n characters of a line with runs a
+    followed by a line with runs b."""
+    if not (a or b):
+        return None
+
+    first = [(o, attr) for o, attr in offsets(a) if o < n]
+    return normal(first + [(n, at(b, 0))] + [(n + o, attr) for o, attr in offsets(b)])
+
+
+def local(attr):
+    """Return the curses attribute for attr, an attribute sent by a server."""
+    colors = attr >> REMOTE
+    attr &= (1 << REMOTE) - 1
+    if colors:
+        attr |= pair((colors & COLOR) - 1, (colors >> 9) - 1)
+
+    return attr
+
+
+def normal(items):
+    """Return runs from offset, attribute pairs in order, leaving out those
+    that don't change the attribute. None if all of it is plain."""
+    runs = array.array("I")
+    for x, attr in items:
+        if runs and runs[-2] == x:
+            del runs[-2:]
+
+        if attr != (runs[-1] if runs else 0):
+            runs.extend((x, attr))
+
+    return runs or None
+
+
+def numbers(params):
+    return [int(p) if p.isdigit() else 0 for p in params]
+
+
+def offsets(runs):
+    """Return the offset, attribute pairs of runs."""
+    if not runs:
+        return []
+
+    return list(zip(runs[::2], runs[1::2]))
+
+
+def pair(fg, bg):
+    """Return the curses attribute for the color pair fg, bg. A color of -1
+    is the terminal's default."""
+    if remote:
+        return (fg + 1 | (bg + 1) << 9) << REMOTE
+
+    if (fg, bg) not in pairs:
+        n = len(pairs) + 1
+        try:
+            if not pairs:
+                # Allows -1 as a color.
+                curses.use_default_colors()
+
+            curses.init_pair(n, fg if fg < 0 else fit(fg), bg if bg < 0 else fit(bg))
+            pairs[(fg, bg)] = curses.color_pair(n)
+        except (curses.error, ValueError):
+            # Out of color pairs, or colors aren't supported.
+            pairs[(fg, bg)] = 0
+
+    return pairs[(fg, bg)]
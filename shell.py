@@ -0,0 +1,322 @@
+"""Decides whether a shell command is complete without running a shell.
+
+Lines are scanned one at a time and the state after each line is cached, so
+only lines that changed since the last check are scanned again. The scanner
+tracks quotes, including ANSI-C $'...' quotes, command substitutions,
+compound commands, here-documents and lines continued with a backslash or a
+trailing pipe or list operator. It doesn't validate syntax. A command with
+an unexpected closing keyword or bracket is considered complete so that the
+shell can report the error."""
+
+# Keywords that open a compound command and the keyword that closes each.
+OPEN = {
+    "case": "esac",
+    "for": "done",
+    "if": "fi",
+    "select": "done",
+    "until": "done",
+    "while": "done",
+}
+
+# Keywords followed by a command rather than a name or word list.
+COMMAND = {"!", "do", "elif", "else", "if", "then", "time", "until", "while"}
+
+# Characters that end a word.
+METACHARACTERS = " \t;&|()<>"
+
+# The scanner state: the stack of open contexts, how the line was continued
+# ("\\" by a backslash, "|" by an operator, otherwise False), and whether an
+# error was seen.
+INITIAL = ((), False, False)
+
+# Commands checked against bash -n when run as a script.
+CASES = [
+    "cat <<< hi",
+    'cat <<< "hi"',
+    "echo $((1<<2))",
+    "echo $((1 +",
+    "x=$(( (1+2) <<3 ))",
+    "(( x <<= 1 ))",
+    "(( x <<= 1",
+    'echo "$((1 << 2))"',
+    "for ((i = 0; i << 2; i++)); do echo $i; done",
+    "for ((i = 0; i << 2; i++)); do",
+    "cat <<EOF\nhi\nEOF",
+    "echo $'it\\'s'",
+    "echo $'it",
+    "echo 'a\\'",
+    "if true; then\necho a\nfi",
+    "echo a |",
+    "echo $( (echo hi) )",
+]
+
+
+class Checker:
+    def __init__(self):
+        self.lines = []
+        self.states = [INITIAL]
+
+    def complete(self, lines):
+        n = 0
+        for line in lines:
+            if n < len(self.lines) and self.lines[n] != line:
+                # Scan again from the first line that changed.
+                del self.lines[n:]
+                del self.states[n + 1 :]
+
+            if n == len(self.lines):
+                self.lines.append(line)
+                self.states.append(scan(line, self.states[-1]))
+
+            n += 1
+
+        del self.lines[n:]
+        del self.states[n + 1 :]
+
+        return complete(self.states[-1])
+
+
+def complete(state):
+    stack, continued, error = state
+    return error or not (stack or continued)
+
+
+def heredoc(line, i):
+    """Return the delimiter, whether leading tabs are stripped, and the index
+    after the here-document operator at i."""
+    i += 2
+
+    strip = line.startswith("-", i)
+    if strip:
+        i += 1
+
+    while i < len(line) and line[i] in " \t":
+        i += 1
+
+    delimiter = ""
+    while i < len(line) and line[i] not in METACHARACTERS:
+        if line[i] not in "'\"\\":
+            delimiter += line[i]
+        i += 1
+
+    return delimiter, strip, i
+
+
+def scan(line, state):
+    """Return the state after line given the state before it."""
+    stack, continued, error = state
+    stack = list(stack)
+
+    if stack and stack[-1][0] == "<<":
+        _, delimiter, strip = stack[-1]
+        if (line.lstrip("\t") if strip else line) == delimiter:
+            stack.pop()
+        return tuple(stack), False, error
+
+    heredocs = []
+
+    # A pipe or list operator continues over blank lines and comments.
+    operator = continued == "|"
+    continued = False
+
+    # Whether the next word is in command position, where keywords are
+    # recognized, and the word being scanned. Quotes are kept in the word so
+    # that a quoted keyword isn't recognized.
+    start = True
+    word = None
+
+    def end(word):
+        nonlocal error, start
+
+        if word is None:
+            return
+
+        top = stack[-1] if stack else None
+
+        if word in OPEN:
+            stack.append(word)
+            start = word in COMMAND
+        elif word in COMMAND:
+            start = True
+        elif word == "{":
+            stack.append(word)
+            start = True
+        elif word == "}":
+            if top == "{":
+                stack.pop()
+            else:
+                error = True
+        elif word in OPEN.values():
+            if top in OPEN and OPEN[top] == word:
+                stack.pop()
+            else:
+                error = True
+        else:
+            start = False
+
+    i = 0
+    while i < len(line):
+        c = line[i]
+        top = stack[-1] if stack else None
+
+        if top == "'":
+            j = line.find("'", i)
+            if j < 0:
+                break
+
+            stack.pop()
+            i = j + 1
+            continue
+
+        if top == "$'":
+            # ANSI-C quoting, where a backslash escapes the next character.
+            if c == "\\":
+                i += 2
+            elif c == "'":
+                stack.pop()
+                i += 1
+            else:
+                i += 1
+            continue
+
+        if top and top[0] == "((":
+            # Arithmetic, where << is a shift. Its parentheses are counted.
+            depth = top[1]
+            if line.startswith("$((", i):
+                stack.append(("((", 0))
+                i += 3
+            elif c == "(":
+                stack[-1] = ("((", depth + 1)
+                i += 1
+            elif c == ")" and depth:
+                stack[-1] = ("((", depth - 1)
+                i += 1
+            elif line.startswith("))", i):
+                stack.pop()
+                i += 2
+            elif line.startswith("$(", i) or line.startswith("${", i):
+                stack.append(line[i : i + 2])
+                i += 2
+            elif c in "'\"`":
+                stack.append(c)
+                i += 1
+            else:
+                i += 1
+            continue
+
+        if top in ('"', "`", "${"):
+            close = "}" if top == "${" else top
+            if c == "\\":
+                i += 2
+            elif c == close:
+                stack.pop()
+                i += 1
+            elif line.startswith("$((", i):
+                stack.append(("((", 0))
+                i += 3
+            elif line.startswith("$(", i) or line.startswith("${", i):
+                stack.append(line[i : i + 2])
+                i += 2
+            elif line.startswith("$'", i) and top != '"':
+                stack.append("$'")
+                i += 2
+            elif c == "`" or c in "'\"" and top != '"':
+                stack.append(c)
+                i += 1
+            else:
+                i += 1
+            continue
+
+        # Unquoted.
+        if c in METACHARACTERS:
+            if word is not None and start:
+                end(word)
+            elif word is not None:
+                start = False
+            word = None
+
+        if c == "#" and word is None:
+            break
+
+        if c == "\\" and i == len(line) - 1:
+            continued = "\\"
+            break
+
+        operator = operator and c in " \t"
+
+        if c in " \t":
+            i += 1
+        elif c == "\\":
+            word = (word or "") + line[i : i + 2]
+            i += 2
+        elif c in "'\"`":
+            stack.append(c)
+            word = (word or "") + c
+            i += 1
+        elif line.startswith("$((", i):
+            stack.append(("((", 0))
+            word = (word or "") + "$"
+            i += 3
+        elif line.startswith("$(", i) or line.startswith("${", i):
+            stack.append(line[i : i + 2])
+            word = (word or "") + "$"
+            i += 2
+        elif line.startswith("$'", i):
+            stack.append("$'")
+            word = (word or "") + "$'"
+            i += 2
+        elif line.startswith("((", i):
+            # An arithmetic command, or for loop.
+            stack.append(("((", 0))
+            start = False
+            i += 2
+        elif c == "(":
+            stack.append(c)
+            start = True
+            i += 1
+        elif c == ")":
+            if top in ("(", "$("):
+                stack.pop()
+            elif top != "case":
+                error = True
+            start = True
+            i += 1
+        elif line.startswith("<<<", i):
+            # A here-string. The word after it is an argument.
+            start = False
+            i += 3
+        elif line.startswith("<<", i):
+            delimiter, strip, i = heredoc(line, i)
+            heredocs.append(("<<", delimiter, strip))
+            start = False
+        elif c in ";&|":
+            pair = line.startswith(c * 2, i)
+
+            # A trailing pipe, && or || continues the command.
+            operator = c == "|" or pair and c == "&"
+
+            start = True
+            i += 2 if pair else 1
+        elif c in "<>":
+            start = False
+            i += 1
+        else:
+            word = (word or "") + c
+            i += 1
+
+    if word is not None and start:
+        end(word)
+
+    stack.extend(reversed(heredocs))
+
+    return tuple(stack), operator and "|" or continued, error
+
+
+if __name__ == "__main__":
+    # Check the checker against bash -n, which fails for incomplete commands.
+    import subprocess
+
+    for case in CASES:
+        expected = not subprocess.run(["bash", "-n"], input=case.encode()).returncode
+        if Checker().complete(case.split("\n")) != expected:
+            print("wrong:", repr(case))
@@ -0,0 +1,55 @@
+"""Times startup.
+
+Marks are recorded, once each, as startup reaches them and reported relative
+to when the process started, so the time the interpreter takes to start is
+included. The process start time is only as precise as a clock tick."""
+
+import os
+import sys
+import time
+
+# (Name, time) pairs in the order they were reached.
+marks = []
+
+
+def mark(name):
+    if not seen(name):
+        marks.append((name, time.monotonic()))
+
+
+def report(f=sys.stderr):
+    start = started()
+    if start is None:
+        start = marks[0][1]
+
+    previous = start
+    for name, when in marks:
+        print(
+            f"{name:<16} {(when - start) * 1000:8.1f} ms"
+            f" (+{(when - previous) * 1000:.1f})",
+            file=f,
+        )
+        previous = when
+
+
+def seen(name):
+    return any(n == name for n, _ in marks)
+
+
+def started():
+    """Return when the process started on the monotonic clock, if known."""
+    try:
+        with open("/proc/self/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+
+    # The command name can contain spaces so fields are counted after it.
+    ticks = int(stat.rsplit(")", 1)[1].split()[19])
+
+    # Process start times are measured from boot, which the monotonic clock
+    # is not, on Linux, if the system has been suspended.
+    since = ticks / os.sysconf("SC_CLK_TCK")
+    now = time.monotonic()
+
+    return now - (time.clock_gettime(time.CLOCK_BOOTTIME) - since)
@@ -0,0 +1,102 @@
+"""Counts and times work done on hot paths.
+
+Each statistic keeps a count, a total and a histogram with a bucket for each
+power of two, so recording a value is cheap and percentiles are approximate
+(to within a factor of two). Times are in nanoseconds."""
+
+import os
+import time
+
+BUCKETS = 64
+
+# The statistics in the order they are summarized.
+ORDER = ("read", "parse", "append", "render", "key", "check", "write")
+
+now = time.perf_counter_ns
+
+# Name -> Stat.
+recorded = {}
+
+
+class Stat:
+    def __init__(self, time):
+        self.count = 0
+        self.histogram = [0] * BUCKETS
+        self.time = time
+        self.total = 0
+
+    def percentile(self, p):
+        """Return the (exclusive) upper bound of the bucket holding the pth
+        percentile."""
+        n = self.count * p
+        seen = 0
+        for b, c in enumerate(self.histogram):
+            seen += c
+            if c and seen >= n:
+                return 1 << b
+
+        return 0
+
+    def record(self, value):
+        self.count += 1
+        self.histogram[min(value.bit_length(), BUCKETS - 1)] += 1
+        self.total += value
+
+
+def count(name, value):
+    """Record a value, like the number of bytes read."""
+    stat = recorded.get(name)
+    if not stat:
+        stat = recorded[name] = Stat(False)
+
+    stat.record(value)
+
+
+def dump():
+    """Write the statistics as JSON to a file and return its name."""
+    # Imported when needed, to keep startup fast.
+    import json
+    import tempfile
+
+    path = os.path.join(tempfile.gettempdir(), f"console-stats-{os.getpid()}.json")
+
+    data = {}
+    for name, stat in recorded.items():
+        last = max(b for b, c in enumerate(stat.histogram) if c)
+        data[name] = {
+            "count": stat.count,
+            "total": stat.total,
+            "unit": "ns" if stat.time else "",
+            "p50": stat.percentile(0.5),
+            "p99": stat.percentile(0.99),
+            # Bucket b counts values less than 2**b.
+            "histogram": stat.histogram[: last + 1],
+        }
+
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+    return path
+
+
+def since(name, start):
+    """Record the time since start, a value returned by now()."""
+    stat = recorded.get(name)
+    if not stat:
+        stat = recorded[name] = Stat(True)
+
+    stat.record(now() - start)
+
+
+def summary():
+    """Return a line with the count and 50th and 99th percentile times, in
+    microseconds, of each statistic."""
+    parts = []
+    for name in ORDER:
+        stat = recorded.get(name)
+        if stat:
+            p50 = stat.percentile(0.5) // 1000
+            p99 = stat.percentile(0.99) // 1000
+            parts.append(f"{name} {stat.count} {p50}/{p99}us")
+
+    return " ".join(parts)
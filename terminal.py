@@ -8,8 +8,13 @@ import tty
 import bindings
 import debug
 import responses
+import sgr
+import stats
 import widget
 
+# Keys that start and switch between sessions, and the requests they make.
+SESSION_KEYS = {"ALT+c": "new", "ALT+n": "next", "ALT+p": "previous"}
+
 previous_rows = 0
 previous_cols = 0
 
@@ -42,63 +47,157 @@ def resize(fd):
 
 
 class Terminal:
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, lines=0, size=0, wrap=False, log=None):
         os.environ.setdefault("ESCDELAY", "50")
 
-        self.buf = widget.EditorPanel(filename)
+        # Only output appended to a file is never evicted.
+        if filename:
+            lines = size = 0
+
+        self.buf = widget.EditorPanel(filename, lines, size)
         self.cli = widget.CommandPanel()
         self.status = widget.StatusPanel()
 
+        self.buf.wrap = self.cli.wrap = wrap
+
         self.editing = filename is not None
+        self.query = ""
         self.selection = None
 
-    def input(self):
-        eof = key_press(self)
+        # The pid of the shell that last prompted for a command.
+        self.shell = None
+
+        # Whether statistics are shown on the status line.
+        self.stats = False
+
+        # The graphic rendition of output. See sgr.py.
+        self.attr = 0
+
+        # The transcript output and commands are logged to, if any.
+        self.log = log
+
+        # Where the cursor was left by the last render. None forces a repaint.
+        self.cursor = None
+
+        # A request for the console to start a new session ("new") or switch
+        # to the "next" or "previous" one, taken by the console after input.
+        self.request = None
+
+    def finished(self, status):
+        """The last command finished with status."""
+        self.status.running = f"(bash) exit {status}" if status else "(bash)"
+
+    def input(self, key=None, mouse=None):
+        """Handle a key press. The key is read from the screen unless it is
+        given by name, with the mouse state for KEY_MOUSE, by a client."""
+        start = stats.now()
+        eof = key_press(self, key, mouse)
+        stats.since("key", start)
+
         if eof:
             return "", eof
 
         cmd, echo = self.cli.command()
         if echo:
-            self.buf.append(cmd)
+            self.output([(cmd, 0)])
             self.status.running = cmd.splitlines()[0].decode("utf8")
 
         return cmd, eof
 
-    def output(self, data):
-        self.buf.append(data)
+    def output(self, pieces):
+        start = stats.now()
+        self.buf.append(pieces)
+        stats.since("append", start)
+
+        if self.log:
+            self.log.put(pieces)
+
+            message = self.log.report()
+            if message:
+                self.status.message = message
+
+    def invalidate(self):
+        """Forget what is on the screen so that the next render repaints it."""
+        self.buf.invalidate()
+        self.cli.invalidate()
+        self.status.invalidate()
+
+        self.cursor = None
+
+    def poll(self):
+        """Check on work done in the background. Returns True while there is
+        more to check on."""
+        busy = self.buf.load()
+
+        saver = self.buf.saver
+        if saver:
+            self.status.message = f"Saving {saver.progress()}%"
+
+            if saver.done:
+                self.buf.saver = None
+                self.status.message = ""
+                if saver.error:
+                    # Not every error is an OSError with a strerror.
+                    error = getattr(saver.error, "strerror", None) or saver.error
+                    self.status.message = f"Save failed: {error}"
+
+            busy |= self.buf.saver is not None
+
+        # Keep statistics current.
+        return busy or self.stats
+
+    def prompt(self, pid, type_ahead):
+        """The shell, with pid, is prompting for a command. Input that
+        wasn't read by the last command is edited as part of the next."""
+        self.shell = pid
+        self.cli.prepend(type_ahead)
+
+        # Colors left on by the last command don't carry over to the next.
+        self.attr = 0
 
     def render(self):
-        # After running some programs (like top) the cursor disappears.
-        # Hiding the cursor ...
-        curses.curs_set(0)
+        damaged = self.cursor is None
+        if damaged:
+            # After running some programs (like top) the cursor disappears.
+            # Hiding the cursor ...
+            visibility(0)
 
-        rows, cols = self.stdscr.getmaxyx()
+            self.stdscr.keypad(1)
 
-        self.stdscr.keypad(1)
+        rows, cols = self.stdscr.getmaxyx()
 
+        drawn = False
         if rows > 1:
             n = min(rows - 1, 0 if self.editing else len(self.cli.text))
             rows -= n
 
-            self.buf.render(self.stdscr, 0, rows - 1, cols)
+            drawn |= self.buf.render(self.stdscr, 0, rows - 1, cols)
 
             x, y = self.cli.cursor.get()
             if self.editing:
                 x, y = self.buf.cursor.get()
 
             self.status.set(x, y)
-            self.status.render(self.stdscr, rows - 1, 1, cols)
+            self.status.stats = stats.summary() if self.stats else ""
+            drawn |= self.status.render(self.stdscr, rows - 1, 1, cols)
 
             sx, sy = self.buf.screen.get()
             if not self.editing:
-                self.cli.render(self.stdscr, rows, n, cols)
+                drawn |= self.cli.render(self.stdscr, rows, n, cols)
                 sx, sy = self.cli.screen.get()
                 sy += rows
 
             self.stdscr.move(sy, sx)
 
-        # ... and then showing it again, seems to fix the problem.
-        curses.curs_set(2)
+            if not drawn and self.cursor == (sx, sy):
+                # Nothing changed. Don't send anything to the terminal.
+                return
+
+            self.cursor = (sx, sy)
+
+        if damaged:
+            # ... and then showing it again, seems to fix the problem.
+            visibility(2)
 
         self.stdscr.refresh()
 
@@ -121,9 +220,9 @@ class Terminal:
 
         curses.wrapper(wrapper, self)
 
-    def type_ahead(self, type_ahead):
-        self.cli.prepend(type_ahead)
-        self.status.running = "(bash)"
+    def style(self, params):
+        """Change the graphic rendition of the output that follows."""
+        self.attr = sgr.apply(self.attr, params)
 
 
 # Helpers.
@@ -156,11 +255,17 @@ def key_by_name(stdscr):
     return curses.keyname(n).decode("utf8")
 
 
-def key_press(self):
-    key = key_by_name(self.stdscr)
+def key_press(self, key=None, mouse=None):
+    if key is None:
+        key = key_by_name(self.stdscr)
+
+    if not self.buf.saver:
+        # Any message, like a failed save, has been seen.
+        self.status.message = ""
+
     if key == "KEY_MOUSE":
         try:
-            id, x, y, z, b = curses.getmouse()
+            id, x, y, z, b = mouse or curses.getmouse()
             # self.status += " id = {} x = {} y = {} z = {} bstate = {}".format(
             #    id, x, y, z, b
             # )
@@ -186,11 +291,25 @@ def key_press(self):
 
     f = bindings.selection(key)
     if f:
-        if self.selection:
-            f(self.selection, key)
+        selection = self.selection
+        if selection and selection.p0.valid() and selection.p1.valid():
+            f(selection, key)
+        elif key == "^C":
+            # Nothing to copy. Interrupt the running program instead.
+            self.cli.complete = b"\x03"
         return False
 
-    if key == "^E":
+    if key in SESSION_KEYS:
+        self.request = SESSION_KEYS[key]
+        return False
+    elif key == "ALT+s":
+        if self.status.prompt != "":
+            return False
+
+        self.status.prompt = "Export scrollback to?"
+        self.status.response = responses.export
+        return False
+    elif key == "^E":
         self.editing = False
         return False
     elif key == "^F":
@@ -207,6 +326,20 @@ def key_press(self):
         self.status.prompt = "Line number?"
         self.status.response = responses.line_number
         return False
+    elif key == "^N":
+        # Next match.
+        if self.status.prompt == "":
+            responses.search(self, self.query, 1, True)
+        return False
+    elif key == "^O":
+        # Wrap, or stop wrapping, long lines.
+        self.buf.wrap = self.cli.wrap = not self.buf.wrap
+        return False
+    elif key == "^P":
+        # Previous match.
+        if self.status.prompt == "":
+            responses.search(self, self.query, -1)
+        return False
     elif key == "^Q":
         if self.editing:
             self.status.prompt = "Exit (y/n)?"
@@ -222,6 +355,9 @@ def key_press(self):
         self.status.prompt = "Reverse search for?"
         self.status.response = responses.reverse_search
         return False
+    elif key == "^T":
+        self.stats = not self.stats
+        return False
     elif key == "^W":
         self.editing = True
         return False
@@ -235,3 +371,11 @@ def key_press(self):
         self.cli.handle(key)
 
     return False
+
+
+def visibility(n):
+    try:
+        curses.curs_set(n)
+    except curses.error:
+        # Curses isn't running when a client shows the screen.
+        pass
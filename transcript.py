@@ -0,0 +1,145 @@
+"""Transcripts.
+
+A transcript is a log of what a session shows in canonical mode: the output
+of commands, decoded, and each command as it is echoed. It is written in
+batches by a background writer, compressed if the file name ends in .gz or
+.zst (which needs the zstandard package), and started again once the file
+reaches a size limit, keeping the last few.
+
+Output is not read from a session while its writer is behind, so that none
+is dropped. A failure to write, or output dropped all the same, is reported
+on the status line."""
+
+import gzip
+import os
+
+import buffer
+import writer
+
+# The most pieces of output held for the writer. Each is one flush of output.
+CAPACITY = 1 << 10
+
+# The pieces held for the writer when it is behind.
+BEHIND = CAPACITY * 3 // 4
+
+# The most transcripts that reached the limit kept.
+KEEP = 4
+
+
+class Transcript:
+    def __init__(self, path, limit=0):
+        self.path = path
+        self.limit = limit
+
+        # Output is decoded, like it is for the panel, by the writer.
+        self.decoder = buffer.Decoder()
+
+        # The error that stopped writing, if any, and whether it was reported.
+        self.error = None
+        self.failed = False
+
+        # The pieces of output dropped, counted by the writer, and how many
+        # of them were reported.
+        self.dropped = 0
+        self.reported = 0
+
+        self.open()
+
+        self.writer = writer.Writer(self.write, capacity=CAPACITY)
+        self.writer.start()
+
+    def behind(self):
+        """Return whether the writer has fallen behind, and output should
+        not be read until it catches up."""
+        return self.writer.backlog() >= BEHIND
+
+    def close(self):
+        """Write what remains and close the file."""
+        self.writer.close()
+
+        self.file.close()
+        self.raw.close()
+
+    def open(self):
+        self.raw = open(self.path, "ab")
+        self.file = compressor(self.path, self.raw)
+
+    def put(self, pieces):
+        """Add pieces of output, as passed to Terminal.output."""
+        self.writer.put(pieces)
+
+    def report(self):
+        """Return a message about an error or dropped output since the last
+        call, or None."""
+        if self.error and not self.failed:
+            self.failed = True
+            error = getattr(self.error, "strerror", None) or self.error
+            return f"Transcript stopped: {error}"
+
+        dropped = self.dropped
+        if dropped > self.reported:
+            self.reported = dropped
+            return f"Transcript dropped {dropped} pieces of output"
+
+        return None
+
+    def rotate(self):
+        self.file.close()
+        self.raw.close()
+
+        for n in range(KEEP - 1, 0, -1):
+            if os.path.exists(self.rotated(n)):
+                os.replace(self.rotated(n), self.rotated(n + 1))
+
+        os.replace(self.path, self.rotated(1))
+
+        self.open()
+
+    def rotated(self, n):
+        """Return the name of the nth newest transcript kept, like log.1 or,
+        keeping the suffix last, log.1.gz."""
+        root, suffix = os.path.splitext(self.path)
+        if suffix in (".gz", ".zst"):
+            return f"{root}.{n}{suffix}"
+
+        return f"{self.path}.{n}"
+
+    def write(self, batch, dropped):
+        if self.error:
+            return
+
+        text = []
+        if dropped:
+            self.dropped += dropped
+            text.append(f"\n[{dropped} pieces of output dropped]\n")
+
+        for pieces in batch:
+            for data, attr in pieces:
+                text.append("\n".join(self.decoder.decode(data)))
+
+        try:
+            self.file.write("".join(text).encode("utf8"))
+            self.file.flush()
+
+            if self.limit and self.raw.tell() >= self.limit:
+                self.rotate()
+        except OSError as e:
+            self.error = e
+
+
+def compressor(path, raw):
+    """Return a file that writes to raw, compressed as path's suffix says."""
+    if path.endswith(".gz"):
+        # Each time the file is opened a gzip member is appended.
+        return gzip.GzipFile(fileobj=raw, mode="ab")
+
+    if path.endswith(".zst"):
+        # Imported when needed, as it is optional.
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compression needs the zstandard package")
+
+        return zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+
+    return raw
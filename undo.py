@@ -0,0 +1,141 @@
+"""Undo and redo.
+
+Edits are kept as operations: the point an edit was made at, and the text it
+removed and inserted there, as raw bytes like Buffer.select returns. Undoing
+one removes what it inserted and inserts what it removed, so it takes time in
+proportion to the edit rather than the buffer: undoing a cut of any size is
+one insert of the lines cut. Characters typed, or deleted, one after another
+on a line are one operation. The oldest operations are forgotten once more
+than a limit of bytes is kept."""
+
+import collections
+
+import buffer
+import point
+
+# The most bytes kept, besides those of the newest operation.
+LIMIT = 1 << 24
+
+# About the bytes an operation takes besides its text.
+OVERHEAD = 128
+
+# Where y is offset by the history's base, like the lines of a Buffer.
+Operation = collections.namedtuple("Operation", ["x", "y", "removed", "inserted"])
+
+
+class History:
+    def __init__(self, limit=LIMIT):
+        self.limit = limit
+
+        # Operations that can be undone, oldest first, and those that can be
+        # redone, next last.
+        self.done = collections.deque()
+        self.undone = []
+
+        # The lines moved by shift, so that it needn't change each operation.
+        self.base = 0
+
+        self.size = 0
+
+    def record(self, x, y, removed, inserted):
+        """Record that removed was replaced by inserted at x, y. What was
+        undone can no longer be redone."""
+        self.size -= sum(map(cost, self.undone))
+        self.undone = []
+
+        op = Operation(x, y + self.base, removed, inserted)
+        if self.done:
+            joined = join(self.done[-1], op)
+            if joined:
+                self.size -= cost(self.done.pop())
+                op = joined
+
+        self.done.append(op)
+        self.size += cost(op)
+
+        while self.size > self.limit and len(self.done) > 1:
+            self.size -= cost(self.done.popleft())
+
+    def redo(self, text):
+        """Redo the operation last undone on text. Returns the point after
+        the text it inserted, or None if there is nothing to redo."""
+        if not self.undone:
+            return None
+
+        op = self.undone.pop()
+        self.done.append(op)
+
+        return replace(text, op.x, op.y - self.base, op.removed, op.inserted)
+
+    def shift(self, n):
+        """Move the operations n lines down, as lines were added above them,
+        or up if n is negative, as lines were evicted. Operations on evicted
+        lines are dropped, with those that can only be undone after them or
+        redone before them."""
+        self.base -= n
+
+        for i in range(len(self.done) - 1, -1, -1):
+            if self.done[i].y < self.base:
+                for _ in range(i + 1):
+                    self.size -= cost(self.done.popleft())
+                break
+
+        for i in range(len(self.undone) - 1, -1, -1):
+            if self.undone[i].y < self.base:
+                self.size -= sum(map(cost, self.undone[: i + 1]))
+                del self.undone[: i + 1]
+                break
+
+    def undo(self, text):
+        """Undo the last operation on text. Returns the point after the text
+        it restored, or None if there is nothing to undo."""
+        if not self.done:
+            return None
+
+        op = self.done.pop()
+        self.undone.append(op)
+
+        return replace(text, op.x, op.y - self.base, op.inserted, op.removed)
+
+
+def cost(op):
+    return len(op.removed) + len(op.inserted) + OVERHEAD
+
+
+def end(x, y, raw):
+    """Return the point after raw inserted at x, y."""
+    n = raw.count(b"\n")
+    last = buffer.split(raw[raw.rfind(b"\n") + 1 :])[0]
+    if not n:
+        return point.Point(x + len(last), y)
+
+    return point.Point(len(last), y + n)
+
+
+def join(last, op):
+    """Return last and op as one operation if op is a character typed after,
+    or deleted before, the text of last. Otherwise None."""
+    if not (last.removed or op.removed) and len(op.inserted.decode("utf8")) == 1:
+        if b"\n" not in last.inserted + op.inserted:
+            after = end(last.x, last.y, last.inserted)
+            if after.equal(op.x, op.y):
+                return last._replace(inserted=last.inserted + op.inserted)
+
+    if not (last.inserted or op.inserted) and len(op.removed.decode("utf8")) == 1:
+        after = end(op.x, op.y, op.removed)
+        if after.equal(last.x, last.y):
+            return op._replace(removed=op.removed + last.removed)
+
+    return None
+
+
+def replace(text, x, y, removed, inserted):
+    """Replace removed, at x, y in text, with inserted. Returns the point
+    after inserted."""
+    start = point.Point(x, y)
+    if removed:
+        text.remove(start, end(x, y, removed))
+    if inserted:
+        text.insert(start, inserted)
+
+    return end(x, y, inserted)
@@ -0,0 +1,234 @@
+"""A parser for the escape sequences in output sent to a terminal.
+
+The parser is the VT500 state machine described by Paul Williams
+(https://vt100.net/emu/dec_ansi_parser) driven by a table with an action and
+next state for each state and byte. Text, and the contents of OSC and DCS
+strings, are found with a single search rather than byte by byte. The
+parser is resumable: a sequence split across reads is completed by the next
+call to feed. C1 controls are not recognized as output is assumed to be
+UTF-8, where those bytes are continuation bytes."""
+
+import collections
+import re
+
+# States.
+(
+    GROUND,
+    ESCAPE,
+    ESCAPE_INTERMEDIATE,
+    CSI_ENTRY,
+    CSI_PARAM,
+    CSI_INTERMEDIATE,
+    CSI_IGNORE,
+    DCS_ENTRY,
+    DCS_PARAM,
+    DCS_INTERMEDIATE,
+    DCS_PASSTHROUGH,
+    DCS_IGNORE,
+    OSC_STRING,
+    SOS_PM_APC_STRING,
+) = range(14)
+
+# Actions.
+(
+    IGNORE,
+    CLEAR,
+    ABORT,
+    COLLECT,
+    PARAM,
+    ESC_DISPATCH,
+    CSI_DISPATCH,
+    HOOK,
+    PUT,
+    OSC_END,
+) = range(10)
+
+ESC = 0x1B
+
+# States whose contents are found by searching for their terminator.
+STRINGS = {
+    DCS_PASSTHROUGH: re.compile(rb"[\x18\x1a\x1b]"),
+    DCS_IGNORE: re.compile(rb"[\x18\x1a\x1b]"),
+    OSC_STRING: re.compile(rb"[\x07\x18\x1a\x1b]"),
+    SOS_PM_APC_STRING: re.compile(rb"[\x18\x1a\x1b]"),
+}
+
+# A parsed sequence, or run of text. The kind is one of "text", "esc",
+# "csi", "osc", "dcs" or, for an aborted or ignored sequence, "ignore".
+Event = collections.namedtuple("Event", "kind params intermediates final data raw")
+
+
+def build():
+    table = [[(IGNORE, None)] * 256 for _ in range(14)]
+
+    def on(states, first, last, action, state=None):
+        for s in states:
+            for b in range(first, last + 1):
+                table[s][b] = (action, state)
+
+    every = range(14)
+
+    on([GROUND], 0x00, 0xFF, PUT)
+
+    on([ESCAPE], 0x20, 0x2F, COLLECT, ESCAPE_INTERMEDIATE)
+    on([ESCAPE], 0x30, 0x7E, ESC_DISPATCH, GROUND)
+    on([ESCAPE], 0x50, 0x50, IGNORE, DCS_ENTRY)
+    on([ESCAPE], 0x58, 0x58, IGNORE, SOS_PM_APC_STRING)
+    on([ESCAPE], 0x5B, 0x5B, IGNORE, CSI_ENTRY)
+    on([ESCAPE], 0x5D, 0x5D, IGNORE, OSC_STRING)
+    on([ESCAPE], 0x5E, 0x5F, IGNORE, SOS_PM_APC_STRING)
+
+    on([ESCAPE_INTERMEDIATE], 0x20, 0x2F, COLLECT)
+    on([ESCAPE_INTERMEDIATE], 0x30, 0x7E, ESC_DISPATCH, GROUND)
+
+    # Private markers (<=>?) are kept with the parameters.
+    on([CSI_ENTRY], 0x20, 0x2F, COLLECT, CSI_INTERMEDIATE)
+    on([CSI_ENTRY], 0x30, 0x3F, PARAM, CSI_PARAM)
+    on([CSI_ENTRY], 0x40, 0x7E, CSI_DISPATCH, GROUND)
+
+    on([CSI_PARAM], 0x20, 0x2F, COLLECT, CSI_INTERMEDIATE)
+    on([CSI_PARAM], 0x30, 0x3B, PARAM)
+    on([CSI_PARAM], 0x3C, 0x3F, IGNORE, CSI_IGNORE)
+    on([CSI_PARAM], 0x40, 0x7E, CSI_DISPATCH, GROUND)
+
+    on([CSI_INTERMEDIATE], 0x20, 0x2F, COLLECT)
+    on([CSI_INTERMEDIATE], 0x30, 0x3F, IGNORE, CSI_IGNORE)
+    on([CSI_INTERMEDIATE], 0x40, 0x7E, CSI_DISPATCH, GROUND)
+
+    on([CSI_IGNORE], 0x40, 0x7E, ABORT, GROUND)
+
+    on([DCS_ENTRY], 0x20, 0x2F, COLLECT, DCS_INTERMEDIATE)
+    on([DCS_ENTRY], 0x30, 0x3F, PARAM, DCS_PARAM)
+    on([DCS_ENTRY], 0x40, 0x7E, HOOK, DCS_PASSTHROUGH)
+
+    on([DCS_PARAM], 0x20, 0x2F, COLLECT, DCS_INTERMEDIATE)
+    on([DCS_PARAM], 0x30, 0x3B, PARAM)
+    on([DCS_PARAM], 0x3C, 0x3F, IGNORE, DCS_IGNORE)
+    on([DCS_PARAM], 0x40, 0x7E, HOOK, DCS_PASSTHROUGH)
+
+    on([DCS_INTERMEDIATE], 0x20, 0x2F, COLLECT)
+    on([DCS_INTERMEDIATE], 0x30, 0x3F, IGNORE, DCS_IGNORE)
+    on([DCS_INTERMEDIATE], 0x40, 0x7E, HOOK, DCS_PASSTHROUGH)
+
+    on([DCS_PASSTHROUGH], 0x00, 0xFF, PUT)
+    on([DCS_PASSTHROUGH], 0x7F, 0x7F, IGNORE)
+
+    on([OSC_STRING], 0x07, 0x07, OSC_END, GROUND)
+    on([OSC_STRING], 0x20, 0xFF, PUT)
+
+    # Transitions from anywhere.
+    on(every, 0x18, 0x18, ABORT, GROUND)
+    on(every, 0x1A, 0x1A, ABORT, GROUND)
+    on(every, ESC, ESC, CLEAR, ESCAPE)
+
+    return table
+
+
+TABLE = build()
+
+
+class Parser:
+    def __init__(self):
+        self.state = GROUND
+
+        # The bytes of the sequence being parsed and its parts.
+        self.raw = bytearray()
+        self.params = bytearray()
+        self.intermediates = bytearray()
+        self.data = bytearray()
+        self.final = b""
+
+    def feed(self, data):
+        """Return the events in data."""
+        events = []
+
+        i = 0
+        n = len(data)
+        while i < n:
+            if self.state == GROUND:
+                j = data.find(b"\x1b", i)
+                if j < 0:
+                    j = n
+
+                if j > i:
+                    text = data[i:j]
+                    events.append(Event("text", b"", b"", b"", text, text))
+
+                i = j
+                if i == n:
+                    break
+
+            elif self.state in STRINGS:
+                m = STRINGS[self.state].search(data, i)
+                j = m.start() if m else n
+
+                self.raw += data[i:j]
+                if self.state != DCS_IGNORE and self.state != SOS_PM_APC_STRING:
+                    self.data += data[i:j]
+
+                i = j
+                if i == n:
+                    break
+
+            b = data[i]
+            i += 1
+
+            action, state = TABLE[self.state][b]
+
+            if action == CLEAR:
+                # An escape ends whatever came before it.
+                self.flush(events)
+                self.params.clear()
+                self.intermediates.clear()
+                self.data.clear()
+
+            self.raw.append(b)
+
+            if action == COLLECT:
+                self.intermediates.append(b)
+            elif action == PARAM:
+                self.params.append(b)
+            elif action == PUT:
+                self.data.append(b)
+            elif action == ESC_DISPATCH:
+                self.emit(events, "esc", data[i - 1 : i])
+            elif action == CSI_DISPATCH:
+                self.emit(events, "csi", data[i - 1 : i])
+            elif action == HOOK:
+                # The DCS is emitted, with its data, when it is terminated.
+                self.final = data[i - 1 : i]
+            elif action == OSC_END:
+                self.emit(events, "osc")
+            elif action == ABORT:
+                self.emit(events, "ignore")
+
+            if state is not None:
+                self.state = state
+
+        return events
+
+    def emit(self, events, kind, final=b""):
+        events.append(
+            Event(
+                kind,
+                bytes(self.params),
+                bytes(self.intermediates),
+                final,
+                bytes(self.data),
+                bytes(self.raw),
+            )
+        )
+
+        self.raw.clear()
+
+    def flush(self, events):
+        """Emit the sequence, if any, ended by an escape."""
+        if not self.raw:
+            return
+
+        if self.state == OSC_STRING:
+            self.emit(events, "osc")
+        elif self.state == DCS_PASSTHROUGH:
+            self.emit(events, "dcs", self.final)
+        else:
+            self.emit(events, "ignore")
@@ -1,11 +1,16 @@
 import curses
-import enum
 
 import actions
 import bindings
 import buffer
+import cells
 import debug
+import layout
 import point
+import search
+import sgr
+import shell
+import undo
 
 
 class StatusPanel(point.Point):
@@ -16,6 +21,12 @@ class StatusPanel(point.Point):
         self.complete = ""
         self.running = ""
 
+        # Shown in place of what is running, when set.
+        self.message = ""
+        self.stats = ""
+
+        self.invalidate()
+
     def clear(self):
         # The cursor and selection points uses buffer co-ordinates.
         self.cursor = point.Point(0, 0)
@@ -24,6 +35,7 @@ class StatusPanel(point.Point):
         self.prompt = ""
 
         self.text = buffer.Buffer([""])
+        self.history = undo.History()
 
     def command(self):
         cmd = self.complete
@@ -33,26 +45,38 @@ class StatusPanel(point.Point):
     def handle(self, key):
         bindings.prompt(key)(self, key)
 
+    def invalidate(self):
+        self.rendered = None
+
     def render(self, stdscr, offset, height, width):
         if self.prompt == "":
             loc = f"{self.y + 1},{self.x} "
-            run = f"{self.running[:int(width/2)+1]}"
+            run = f"{(self.message or self.running)[:int(width/2)+1]}"
+            if self.stats and not self.message:
+                run = self.stats[: width - len(loc) - 1]
 
             if len(loc) + len(run) > width:
                 # Not enough room. Display nothing.
                 loc = ""
                 run = ""
 
-            spacer = " " * (width - len(loc) - len(run))
-            addstr(stdscr, offset, 0, run + spacer + loc, curses.A_REVERSE)
+            line = run + " " * (width - len(loc) - len(run)) + loc
 
         else:
             prompt = f"{self.prompt} {self.text[0]}"[:width]
             if len(prompt) > width:
                 prompt = "?"
 
-            spacer = " " * (width - len(prompt))
-            addstr(stdscr, offset, 0, prompt + spacer, curses.A_REVERSE)
+            line = prompt + " " * (width - len(prompt))
+
+        # Only repaint the status line when its text (or position) differs.
+        if self.rendered == (offset, line):
+            return False
+
+        self.rendered = (offset, line)
+        addstr(stdscr, offset, 0, line, curses.A_REVERSE)
+
+        return True
 
 
 class Panel:
@@ -60,6 +84,15 @@ class Panel:
         self.clear()
 
         self.height = 0
+        self.width = 0
+
+        # The column shown at the left edge, when not wrapping.
+        self.left = 0
+
+        # Whether long lines are wrapped rather than scrolled horizontally.
+        self.wrap = False
+
+        self.invalidate()
 
     def clear(self):
         # The cursor and selection points uses buffer co-ordinates.
@@ -74,6 +107,7 @@ class Panel:
         self.screen = point.Point(0, 0)
 
         self.text = buffer.Buffer([""])
+        self.history = undo.History()
 
     def clear_selection(self):
         # The beginning, ending, and selection points use buffer co-ordinates.
@@ -94,38 +128,26 @@ class Panel:
         self.screen.x += deltax
         self.screen.y += deltay
 
-    def goto_text(self, text, by=1):
-        y = self.cursor.y
-
-        line = self.text[y]
-        start = 0
-        end = len(line)
-
-        if by > 0:
-            start = self.cursor.x
-        else:
-            end = self.cursor.x
-
-        idx = -1
-        line = line[start:end]
-        while True:
-            if by > 0:
-                idx = line.find(text)
-            else:
-                idx = line.rfind(text)
-
-            if idx != -1:
-                break
+    def goto_text(self, text, by=1, skip=False):
+        """Move the cursor to the next (or previous) match for text. If skip,
+        a match at the cursor is skipped."""
+        if not text:
+            return
 
-            y += by
-            if y < 0 or y > len(self.text):
-                break
+        x = self.cursor.x
+        if skip and by > 0:
+            x += 1
 
-            start = 0
-            line = self.text[y]
+        found = search.find(self.text, search.query(text), x, self.cursor.y, by)
+        if found:
+            self.goto_line(found[1], found[0])
 
-        if idx != -1:
-            self.goto_line(y, start + idx)
+    def invalidate(self):
+        # The frame is the state the last render depended on, and rows holds,
+        # for each row on screen, the line and selection that were drawn.
+        self.painted = None
+        self.frame = None
+        self.rows = []
 
     def mouse(self, b, x, y):
         event = 0
@@ -140,9 +162,26 @@ class Panel:
             curses.BUTTON1_RELEASED: actions.mouse_left_released,
         }.get(event, lambda p, x, y: None)(self, x, y)
 
+    def position(self, x, y):
+        """Return the buffer co-ordinates shown at display co-ordinates x, y.
+        They may be past the end of a line or, when not wrapping, the text."""
+        if not self.wrap:
+            y += self.cursor.y - self.screen.y
+            line = self.text[y] if 0 <= y < len(self.text) else ""
+            return cells.index(line, self.left + x), y
+
+        line = self.text[self.cursor.y]
+        r, _ = layout.place(line, self.cursor.x, self.width)
+
+        n = y - self.screen.y
+        y, r, _ = layout.walk(self.text, self.cursor.y, r, n, self.width)
+
+        return layout.index(self.text[y], r, x, self.width), y
+
     def render(self, stdscr, offset, height, width):
-        # Save height.
+        # Save height and width.
         self.height = height
+        self.width = width
 
         n = point.correction(self.cursor.y, 0, len(self.text) - 1)
         self.cursor.y += n
@@ -152,19 +191,97 @@ class Panel:
         self.cursor.x += n
         self.screen.x += n
 
-        # Largest y may be less than height - 1 if the buffer is smaller.
-        self.screen.clip(width - 1, min(height - 1, self.cursor.y))
+        if self.wrap:
+            line = self.text[self.cursor.y]
+            r, self.screen.x = layout.place(line, self.cursor.x, width)
+
+            # The cursor can't be further down than the rows above it.
+            _, _, above = layout.walk(self.text, self.cursor.y, r, 1 - height, width)
+            self.screen.y += point.correction(self.screen.y, 0, above)
+
+            # The line, and row within it, at the top.
+            top = layout.walk(self.text, self.cursor.y, r, -self.screen.y, width)
+            row, sub, _ = top
+            col = self.left = 0
+        else:
+            # Largest y may be less than height - 1 if the buffer is smaller.
+            self.screen.clip(width - 1, min(height - 1, self.cursor.y))
+
+            # Scroll only as far as needed to show the cursor's column.
+            x = cells.column(self.text[self.cursor.y], self.cursor.x)
+            self.left -= point.correction(x, self.left, self.left + width - 1)
+            self.screen.x = x - self.left
+
+            col = self.left
+            row = max(0, self.cursor.y - self.screen.y)
+            sub = 0
+
+        frame = (
+            offset,
+            height,
+            width,
+            row,
+            col,
+            sub,
+            self.wrap,
+            self.text.version,
+            self.p0.get(),
+            self.p1.get(),
+        )
+        if frame == self.frame and self.painted is self.text:
+            # Nothing visible has changed since the last render.
+            stdscr.move(self.screen.y + offset, self.screen.x)
+            return False
+
+        if frame[:7] != (self.frame or ())[:7]:
+            # The panel moved, was resized, or scrolled. Repaint every row.
+            self.rows = [None] * height
 
-        col = max(0, self.cursor.x - self.screen.x)
-        row = max(0, self.cursor.y - self.screen.y)
+        self.painted = self.text
+        self.frame = frame
 
+        drawn = False
+
+        y = row
         for n in range(height):
-            for c in self.text.chunks(width, row + n, col, self.p0, self.p1):
-                attr = curses.A_REVERSE if c.sel else curses.A_NORMAL
-                addstr(stdscr, offset + n, c.col, c.str, attr)
+            line = self.text[y] if y < len(self.text) else None
+            if self.wrap and line is not None:
+                col = layout.start(line, sub, width)
+
+            # Rows are only repainted when their text, renditions or selection
+            # changes.
+            runs = self.text.style(y) if line is not None else None
+            damage = (line, runs, col, self.selected(y))
+            if self.rows[n] != damage:
+                self.rows[n] = damage
+                drawn = True
+
+                for c in self.text.chunks(width, y, col, self.p0, self.p1):
+                    attr = sgr.attributes(c.attr)
+                    if c.sel:
+                        attr ^= curses.A_REVERSE
+
+                    addstr(stdscr, offset + n, c.col, c.str, attr)
+
+            if self.wrap and line is not None and sub + 1 < layout.rows(line, width):
+                sub += 1
+            else:
+                y += 1
+                sub = 0
 
         stdscr.move(self.screen.y + offset, self.screen.x)
 
+        return drawn
+
+    def selected(self, y):
+        if y < self.p0.y or self.p1.y < y:
+            return None
+
+        return (
+            self.p0.x if y == self.p0.y else -1,
+            self.p1.x if y == self.p1.y else -1,
+        )
+
 
 class CommandPanel(Panel):
     def __init__(self):
@@ -173,12 +290,15 @@ class CommandPanel(Panel):
         self.complete = ""
         self.multiline = False
 
+        # Decides, as lines are entered, when a multi-line command is complete.
+        self.syntax = shell.Checker()
+
     def command(self):
         cmd = self.complete
         if not cmd:
             return cmd, False
 
-        echo = self.multiline and cmd not in (b"\x04", b"\n")
+        echo = self.multiline and cmd not in (b"\x03", b"\x04", b"\n")
 
         self.complete = ""
         self.multiline = False
@@ -198,6 +318,7 @@ class CommandPanel(Panel):
         dy = len(text)
         self.cursor.move(0, dy)
         self.screen.move(0, dy)
+        self.history.shift(dy)
 
         text.extend(self.text)
 
@@ -205,20 +326,41 @@ class CommandPanel(Panel):
 
 
 class EditorPanel(Panel):
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, lines=0, size=0):
         super().__init__()
 
+        # Scrollback limits in lines and bytes. Zero means no limit.
+        self.lines = lines
+        self.size = size
+
+        # Output is decoded as a stream as it may be split anywhere.
+        self.decoder = buffer.Decoder()
+
+        # Output appended while the file is loading is deferred until it has
+        # loaded, so that it follows the file.
+        self.deferred = []
+
         self.filename = filename
+        self.loader = None
+        self.saver = None
         if filename:
-            with open(filename, "r") as file:
-                self.text = buffer.Buffer([line.rstrip("\n\r") for line in file])
+            self.loader = buffer.Loader(filename)
+            self.text = buffer.Buffer([])
+            self.text.newline = self.loader.newline
+            self.load()
+
+    def append(self, pieces):
+        """Append pieces of output, each with the graphic rendition it is
+        shown with."""
+        if self.loader:
+            self.deferred.append(pieces)
+            return
 
-    def append(self, data):
         update = self.cursor.y == len(self.text) - 1 and self.cursor.x == len(
             self.text[self.cursor.y]
         )
 
-        self.text.append(data)
+        self.text.extend([(self.decoder.decode(data), attr) for data, attr in pieces])
 
         if update:
             delta = len(self.text) - 1 - self.cursor.y
@@ -229,9 +371,64 @@ class EditorPanel(Panel):
             self.cursor.y += delta
             self.cursor.x = len(self.text[self.cursor.y])
 
+        if self.lines or self.size:
+            self.evict(self.text.evict(self.lines, self.size))
+
+    def evict(self, n):
+        """Remap the cursor, selection points and history after n lines are
+        evicted."""
+        if not n:
+            return
+
+        self.history.shift(-n)
+
+        if self.cursor.y < n:
+            self.cursor.set(0, 0)
+            self.screen.set(0, 0)
+        else:
+            self.cursor.y -= n
+
+        if self.p1.valid():
+            if self.p1.y < n:
+                self.clear_selection()
+            elif self.p0.y < n:
+                self.p0.set(0, 0)
+                self.p1.y -= n
+            else:
+                self.p0.y -= n
+                self.p1.y -= n
+
+        if self.s.valid():
+            if self.s.y < n:
+                self.s.set(0, 0)
+            else:
+                self.s.y -= n
+
     def handle(self, key):
         bindings.editor(key)(self, key)
 
+    def load(self):
+        """Add the blocks of the file found since the last call. Returns True
+        while the file is still loading."""
+        if not self.loader:
+            return False
+
+        done = self.loader.done
+        self.text.load(self.loader.take())
+
+        if done:
+            self.loader = None
+
+            if not len(self.text):
+                # The file is empty.
+                self.text.load([[""]])
+
+            deferred, self.deferred = self.deferred, []
+            for pieces in deferred:
+                self.append(pieces)
+
+        return not done
+
 
 def addstr(stdscr, *args):
     try:
@@ -0,0 +1,63 @@
+"""Messages between a server and the client attached to it.
+
+Each message is a kind byte and a length, followed by that many bytes. Input
+for and output from programs is sent as is and everything else as JSON."""
+
+import json
+import struct
+
+HEADER = struct.Struct("!cI")
+
+# From the server: the rows of the screen changed since the last draw, as
+# {"clear": bool, "rows": [[y, [[attr, text], ...]], ...], "cursor": [y, x]}.
+DRAW = b"d"
+
+# From the server: whether the current session is in canonical mode, and so
+# whether keys are sent by name or as bytes.
+MODE = b"m"
+
+# From the server: output of a full screen program.
+OUTPUT = b"o"
+
+# From the client: a key by name and the mouse state, [name, mouse].
+KEY = b"k"
+
+# From the client: input for a full screen program.
+INPUT = b"i"
+
+# From the client: the size of its screen, [rows, cols].
+SIZE = b"s"
+
+RAW = (INPUT, OUTPUT)
+
+
+class Reader:
+    """Splits what is received into messages."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def feed(self, data):
+        """Return the messages completed by data, as (kind, value) pairs."""
+        self.data += data
+
+        messages = []
+        while len(self.data) >= HEADER.size:
+            kind, n = HEADER.unpack_from(self.data)
+            end = HEADER.size + n
+            if len(self.data) < end:
+                break
+
+            value = bytes(self.data[HEADER.size : end])
+            del self.data[:end]
+
+            messages.append((kind, value if kind in RAW else json.loads(value)))
+
+        return messages
+
+
+def encode(kind, value):
+    if kind not in RAW:
+        value = json.dumps(value, separators=(",", ":")).encode("utf8")
+
+    return HEADER.pack(kind, len(value)) + value
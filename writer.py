@@ -0,0 +1,62 @@
+import collections
+import threading
+
+
+class Writer(threading.Thread):
+    """Writes records in the background.
+
+    Records are put in a ring buffer and handed, in batches, to
+    write(batch, dropped) by a thread that wakes every interval seconds, or
+    sooner when the buffer is half full. Putting a record never blocks; when
+    the buffer is full the oldest record is dropped. The number dropped since
+    the last batch is passed with each batch."""
+
+    def __init__(self, write, capacity=1 << 16, interval=0.25):
+        super().__init__(daemon=True)
+
+        self.capacity = capacity
+        self.dropped = 0
+        self.interval = interval
+        self.records = collections.deque(maxlen=capacity)
+        self.stopped = False
+        self.wake = threading.Event()
+        self.write = write
+
+    def backlog(self):
+        """Return the number of records waiting to be written."""
+        return len(self.records)
+
+    def close(self):
+        """Write what remains and stop."""
+        self.stopped = True
+        self.wake.set()
+        if self.is_alive():
+            self.join()
+        else:
+            self.flush()
+
+    def flush(self):
+        batch = []
+        while self.records:
+            batch.append(self.records.popleft())
+
+        if batch:
+            dropped, self.dropped = self.dropped, 0
+            self.write(batch, dropped)
+
+    def put(self, record):
+        n = len(self.records)
+        if n == self.capacity:
+            self.dropped += 1
+        elif n == self.capacity >> 1:
+            self.wake.set()
+
+        self.records.append(record)
+
+    def run(self):
+        while not self.stopped:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.flush()
+
+        self.flush()